@@ -4,12 +4,18 @@ A Flask-based password manager with AES encryption and secure authentication.
 """
 
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, render_template, request, redirect, url_for, flash, session, g
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from dotenv import load_dotenv
+from sqlalchemy import select, update
+import atexit
+import hmac
 import logging
-from datetime import datetime, timezone
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from datetime import datetime, timedelta, timezone
 
 # Load environment variables
 load_dotenv()
@@ -23,8 +29,16 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', f'sqlite:///{os.path.join(basedir, "instance", "password_manager.db")}')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Engine tuning: larger compiled-statement cache and stale-connection checks;
+# server databases also get a real connection pool (SQLite manages its own)
+engine_options = {'query_cache_size': 1200, 'pool_pre_ping': True}
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    engine_options.update({'pool_size': 10, 'max_overflow': 20})
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+
 # Development configuration - disable template and static file caching
-app.config['TEMPLATES_AUTO_RELOAD'] = True
+# (production keeps compiled templates instead of re-checking them per render)
+app.config['TEMPLATES_AUTO_RELOAD'] = os.getenv('FLASK_ENV') != 'production'
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
 
 # Ensure instance directory exists
@@ -41,22 +55,123 @@ login_manager.login_message = 'Please log in to access this page.'
 login_manager.login_message_category = 'info'
 
 # Import models after db initialization
-from models import User, Password
-from auth import verify_password, hash_password
-from crypto_utils import encrypt_password, decrypt_password
+from models import User, Password, delete_user, get_user_by_username, get_user_password_count, upgrade_schema
+from auth import (
+    verify_password, hash_password, needs_rehash, clear_verification_cache,
+    verify_dummy_password, is_login_throttled, record_failed_login, reset_failed_logins
+)
+from crypto_utils import (
+    derive_master_key_once, derive_pbkdf2_key, encrypt_password, decrypt_password, decrypt_password_batch,
+    decrypt_legacy_password, rewrap_legacy_password
+)
 from forms import LoginForm, RegisterForm, PasswordForm
 
-# Configure logging for security events
+# Create missing tables and upgrade databases from older releases however the
+# app is launched (python app.py, deploy.sh, a WSGI server)
+with app.app_context():
+    db.create_all()
+    upgrade_schema()
+
+# Minimum time between last_login writes for the same user
+LAST_LOGIN_UPDATE_INTERVAL = timedelta(minutes=5)
+
+# Bounded pool for password hashing: Argon2 releases the GIL, so hashes run
+# in parallel across cores while at most one per core is in flight
+HASH_POOL = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='hash')
+
+# Compile every template once at startup so no request pays the Jinja
+# parse/compile cost on first render
+for template_name in app.jinja_env.list_templates():
+    app.jinja_env.get_template(template_name)
+
+# Configure logging for security events: request threads only enqueue
+# records, a background listener thread does the file I/O
+log_queue = queue.Queue(-1)
+security_log_path = os.getenv('SECURITY_LOG_FILE', os.path.join(basedir, 'instance', 'security.log'))
+if os.path.dirname(security_log_path):
+    os.makedirs(os.path.dirname(security_log_path), exist_ok=True)
+security_log_handler = RotatingFileHandler(security_log_path, maxBytes=10_000_000, backupCount=5, delay=True)
+security_log_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+log_listener = QueueListener(log_queue, security_log_handler)
+log_listener.start()
+atexit.register(log_listener.stop)
+
 logging.basicConfig(
-    filename='security.log',
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
+    format='%(message)s',  # final formatting happens on security_log_handler
+    handlers=[QueueHandler(log_queue)]
 )
 
+def cached_user(user_id):
+    """Get a user by ID, querying the database at most once per request"""
+    if 'user_cache' not in g:
+        g.user_cache = {}
+    if user_id not in g.user_cache:
+        g.user_cache[user_id] = db.session.get(User, user_id)
+    return g.user_cache[user_id]
+
+def get_vault_key():
+    """Derive the current user's vault key at most once per request"""
+    if 'master_key' not in g:
+        g.master_key = derive_master_key_once(current_user.encryption_key, current_user.key_salt)
+    return g.master_key
+
+def get_legacy_vault_key():
+    """Derive the current user's PBKDF2 vault key (entries not yet rewrapped) at most once per request"""
+    if 'legacy_key' not in g:
+        g.legacy_key = derive_pbkdf2_key(current_user.encryption_key, current_user.key_salt)
+    return g.legacy_key
+
+def decrypt_legacy_entry(encrypted_password):
+    """Decrypt one stored password in a legacy format"""
+    return decrypt_legacy_password(
+        encrypted_password, current_user.encryption_key, current_user.key_salt, get_legacy_vault_key()
+    )
+
+def decrypt_entry(encrypted_password):
+    """Decrypt one stored password, falling back to legacy formats not yet rewrapped"""
+    try:
+        return decrypt_password(encrypted_password, get_vault_key())
+    except (ValueError, RuntimeError):
+        return decrypt_legacy_entry(encrypted_password)
+
+def rewrap_legacy_passwords(user, key):
+    """Re-encrypt a user's legacy entries under the vault key; returns how many changed"""
+    rows = db.session.execute(
+        select(Password.id, Password.encrypted_password).where(Password.user_id == user.id)
+    ).all()
+    
+    # The legacy key is only derived if some entry does not open under the vault key
+    legacy_key = None
+    if None in decrypt_password_batch((row.encrypted_password for row in rows), key):
+        legacy_key = get_legacy_vault_key()
+    
+    rewrapped = 0
+    for row in rows:
+        try:
+            new_encrypted = rewrap_legacy_password(
+                row.encrypted_password, user.encryption_key, user.key_salt, key, legacy_key
+            )
+        except (ValueError, RuntimeError) as e:
+            logging.error("Could not rewrap password ID %s: %s", row.id, e)
+            continue
+        
+        if new_encrypted is not None:
+            # A format upgrade is not an edit, so updated_at keeps its value
+            db.session.execute(
+                update(Password)
+                .where(Password.id == row.id)
+                .values(encrypted_password=new_encrypted, updated_at=Password.updated_at)
+                .execution_options(synchronize_session=False)
+            )
+            rewrapped += 1
+    
+    return rewrapped
+
 @login_manager.user_loader
 def load_user(user_id):
     """Load user for Flask-Login"""
-    return db.session.get(User, int(user_id))
+    return cached_user(int(user_id))
 
 @app.route('/')
 def index():
@@ -75,18 +190,11 @@ def register():
         email = form.email.data
         password = form.password.data
         
-        # Check if user already exists
-        if User.query.filter_by(username=username).first():
-            flash('Username already exists. Please choose a different one.', 'error')
-            return render_template('register.html', form=form)
-        
-        if User.query.filter_by(email=email).first():
-            flash('Email already registered. Please use a different email.', 'error')
-            return render_template('register.html', form=form)
+        # Username and email availability was checked by RegisterForm in one query
         
         # Create new user with hashed password
         try:
-            hashed_password = hash_password(password)
+            hashed_password = HASH_POOL.submit(hash_password, password).result()
             new_user = User(
                 username=username,
                 email=email,
@@ -97,14 +205,14 @@ def register():
             db.session.commit()
             
             # Log security event
-            logging.info(f"New user registered: {username} from IP: {request.remote_addr}")
+            logging.info("New user registered: %s from IP: %s", username, request.remote_addr)
             
             flash('Registration successful! Please log in.', 'success')
             return redirect(url_for('login'))
             
         except Exception as e:
             db.session.rollback()
-            logging.error(f"Registration error for {username}: {str(e)}")
+            logging.error("Registration error for %s: %s", username, e)
             flash('Registration failed. Please try again.', 'error')
     
     return render_template('register.html', form=form)
@@ -118,18 +226,56 @@ def login():
         username = form.username.data
         password = form.password.data
         remember = form.remember.data
+        ip_address = request.remote_addr
         
-        user = User.query.filter_by(username=username).first()
+        # Refuse throttled clients before spending any hashing work
+        if is_login_throttled(ip_address, username):
+            logging.warning("Throttled login attempt: %s from IP: %s", username, ip_address)
+            flash('Too many failed login attempts. Please try again later.', 'error')
+            return render_template('login.html', form=form)
+        
+        user = get_user_by_username(username)
+        
+        if user is None:
+            # Keep response time independent of whether the username exists
+            verify_dummy_password(password)
         
         if user and verify_password(password, user.password_hash):
+            reset_failed_logins(ip_address, username)
             login_user(user, remember=remember)
             
-            # Update last login
-            user.last_login = datetime.now(timezone.utc)
-            db.session.commit()
+            # Derive the vault key once and move any legacy entries onto it
+            g.master_key = derive_master_key_once(user.encryption_key, user.key_salt)
+            rewrapped = rewrap_legacy_passwords(user, g.master_key)
+            
+            # Collect login bookkeeping into a single UPDATE
+            now = datetime.now(timezone.utc)
+            changes = {}
+            
+            # Transparently upgrade legacy or outdated password hashes
+            if needs_rehash(user.password_hash):
+                changes['password_hash'] = HASH_POOL.submit(hash_password, password).result()
+            
+            # Update last login, skipping the write for frequent re-logins
+            last_login = user.last_login
+            if last_login is not None and last_login.tzinfo is None:
+                last_login = last_login.replace(tzinfo=timezone.utc)
+            if last_login is None or now - last_login >= LAST_LOGIN_UPDATE_INTERVAL:
+                changes['last_login'] = now
+            
+            if changes:
+                db.session.execute(
+                    update(User)
+                    .where(User.id == user.id)
+                    .values(**changes)
+                    .execution_options(synchronize_session=False)
+                )
+            
+            if changes or rewrapped:
+                db.session.commit()
             
             # Log successful login
-            logging.info(f"Successful login: {username} from IP: {request.remote_addr}")
+            logging.info("Successful login: %s from IP: %s", username, ip_address)
             
             # Redirect to next page or dashboard
             next_page = request.args.get('next')
@@ -137,7 +283,8 @@ def login():
             return redirect(next_page) if next_page else redirect(url_for('dashboard'))
         else:
             # Log failed login attempt
-            logging.warning(f"Failed login attempt: {username} from IP: {request.remote_addr}")
+            record_failed_login(ip_address, username)
+            logging.warning("Failed login attempt: %s from IP: %s", username, ip_address)
             flash('Invalid username or password.', 'error')
     
     return render_template('login.html', form=form)
@@ -148,7 +295,7 @@ def logout():
     """User logout"""
     username = current_user.username
     logout_user()
-    logging.info(f"User logged out: {username}")
+    logging.info("User logged out: %s", username)
     flash('You have been logged out successfully.', 'info')
     return redirect(url_for('index'))
 
@@ -156,29 +303,43 @@ def logout():
 @login_required
 def dashboard():
     """Main dashboard showing user's stored passwords"""
-    passwords = Password.query.filter_by(user_id=current_user.id).all()
+    # Fetch plain row tuples instead of materializing ORM objects
+    rows = db.session.execute(
+        select(
+            Password.id, Password.service, Password.username, Password.encrypted_password,
+            Password.url, Password.notes, Password.created_at, Password.updated_at
+        ).where(Password.user_id == current_user.id)
+    ).all()
     
     # Decrypt passwords for display (only in memory, never stored decrypted)
+    plaintexts = decrypt_password_batch((row.encrypted_password for row in rows), get_vault_key())
+    
     decrypted_passwords = []
-    for pwd in passwords:
-        try:
-            decrypted_pwd = decrypt_password(pwd.encrypted_password, current_user.encryption_key)
-            decrypted_passwords.append({
-                'id': pwd.id,
-                'service': pwd.service,
-                'username': pwd.username,
-                'password': decrypted_pwd,
-                'url': pwd.url,
-                'notes': pwd.notes,
-                'created_at': pwd.created_at,
-                'updated_at': pwd.updated_at
-            })
-        except Exception as e:
-            logging.error(f"Decryption error for password ID {pwd.id}: {str(e)}")
-            # Skip corrupted entries
-            continue
+    for row, decrypted_pwd in zip(rows, plaintexts):
+        if decrypted_pwd is None:
+            # Entries not yet rewrapped at login share one legacy key per request
+            try:
+                decrypted_pwd = decrypt_legacy_entry(row.encrypted_password)
+            except (ValueError, RuntimeError):
+                # Skip corrupted entries
+                logging.error("Decryption error for password ID %s", row.id)
+                continue
+        
+        decrypted_passwords.append({
+            'id': row.id,
+            'service': row.service,
+            'username': row.username,
+            'password': decrypted_pwd,
+            'url': row.url,
+            'notes': row.notes,
+            'created_at': row.created_at,
+            'updated_at': row.updated_at
+        })
     
-    return render_template('dashboard.html', passwords=decrypted_passwords)
+    # Rendered in full (not streamed) so flashed messages are consumed before the
+    # session cookie is written, and the count covers only entries that decrypted
+    return render_template('dashboard.html', passwords=decrypted_passwords,
+                           password_count=len(decrypted_passwords))
 
 @app.route('/add_password', methods=['GET', 'POST'])
 @login_required
@@ -195,7 +356,7 @@ def add_password():
         
         try:
             # Encrypt the password before storing
-            encrypted_password = encrypt_password(password, current_user.encryption_key)
+            encrypted_password = encrypt_password(password, get_vault_key())
             
             new_password = Password(
                 user_id=current_user.id,
@@ -209,13 +370,13 @@ def add_password():
             db.session.add(new_password)
             db.session.commit()
             
-            logging.info(f"Password added for service '{service}' by user {current_user.username}")
+            logging.info("Password added for service '%s' by user %s", service, current_user.username)
             flash(f'Password for {service} added successfully!', 'success')
             return redirect(url_for('dashboard'))
             
         except Exception as e:
             db.session.rollback()
-            logging.error(f"Error adding password for {current_user.username}: {str(e)}")
+            logging.error("Error adding password for %s: %s", current_user.username, e)
             flash('Failed to add password. Please try again.', 'error')
     
     return render_template('add_password.html', form=form)
@@ -235,37 +396,36 @@ def edit_password(password_id):
             password_entry.username = form.username.data
             password_entry.url = form.url.data
             password_entry.notes = form.notes.data
-            password_entry.updated_at = datetime.now(timezone.utc)
             
             # Re-encrypt if password changed
             if form.password.data:
                 password_entry.encrypted_password = encrypt_password(
                     form.password.data, 
-                    current_user.encryption_key
+                    get_vault_key()
                 )
             
             db.session.commit()
             
-            logging.info(f"Password updated for service '{password_entry.service}' by user {current_user.username}")
+            logging.info("Password updated for service '%s' by user %s", password_entry.service, current_user.username)
             flash(f'Password for {password_entry.service} updated successfully!', 'success')
             return redirect(url_for('dashboard'))
             
         except Exception as e:
             db.session.rollback()
-            logging.error(f"Error updating password for {current_user.username}: {str(e)}")
+            logging.error("Error updating password for %s: %s", current_user.username, e)
             flash('Failed to update password. Please try again.', 'error')
     
     # Pre-populate form with existing data
     if request.method == 'GET':
         try:
-            decrypted_password = decrypt_password(password_entry.encrypted_password, current_user.encryption_key)
+            decrypted_password = decrypt_entry(password_entry.encrypted_password)
             form.service.data = password_entry.service
             form.username.data = password_entry.username
             form.password.data = decrypted_password
             form.url.data = password_entry.url
             form.notes.data = password_entry.notes
         except Exception as e:
-            logging.error(f"Error decrypting password for editing: {str(e)}")
+            logging.error("Error decrypting password for editing: %s", e)
             flash('Error loading password data.', 'error')
             return redirect(url_for('dashboard'))
     
@@ -282,12 +442,12 @@ def delete_password(password_id):
         db.session.delete(password_entry)
         db.session.commit()
         
-        logging.info(f"Password deleted for service '{service_name}' by user {current_user.username}")
+        logging.info("Password deleted for service '%s' by user %s", service_name, current_user.username)
         flash(f'Password for {service_name} deleted successfully!', 'success')
         
     except Exception as e:
         db.session.rollback()
-        logging.error(f"Error deleting password for {current_user.username}: {str(e)}")
+        logging.error("Error deleting password for %s: %s", current_user.username, e)
         flash('Failed to delete password. Please try again.', 'error')
     
     return redirect(url_for('dashboard'))
@@ -314,20 +474,22 @@ def settings():
                 flash('New password must be at least 8 characters long.', 'error')
                 return redirect(url_for('settings'))
             
-            if new_password != confirm_password:
+            # Constant-time comparison (bytes, so non-ASCII input is accepted)
+            if not hmac.compare_digest(new_password.encode('utf-8'), (confirm_password or '').encode('utf-8')):
                 flash('New passwords do not match.', 'error')
                 return redirect(url_for('settings'))
             
             # Update password
             try:
-                current_user.password_hash = hash_password(new_password)
+                current_user.password_hash = HASH_POOL.submit(hash_password, new_password).result()
                 db.session.commit()
+                clear_verification_cache()
                 flash('Password changed successfully.', 'success')
-                logging.info(f"Password changed: user={current_user.username}")
+                logging.info("Password changed: user=%s", current_user.username)
             except Exception as e:
                 db.session.rollback()
                 flash('An error occurred while changing password.', 'error')
-                logging.error(f"Password change failed: user={current_user.username}, error={str(e)}")
+                logging.error("Password change failed: user=%s, error=%s", current_user.username, e)
         
         elif action == 'update_profile':
             username = request.form.get('username', '').strip()
@@ -353,11 +515,11 @@ def settings():
                 current_user.username = username
                 db.session.commit()
                 flash('Profile updated successfully.', 'success')
-                logging.info(f"Username changed: {old_username} -> {username}")
+                logging.info("Username changed: %s -> %s", old_username, username)
             except Exception as e:
                 db.session.rollback()
                 flash('An error occurred while updating profile.', 'error')
-                logging.error(f"Profile update failed: user={current_user.username}, error={str(e)}")
+                logging.error("Profile update failed: user=%s, error=%s", current_user.username, e)
         
         elif action == 'delete_account':
             confirm_password = request.form.get('delete_confirm_password')
@@ -368,28 +530,25 @@ def settings():
                 return redirect(url_for('settings'))
             
             try:
-                # Delete all user's passwords first
-                Password.query.filter_by(user_id=current_user.id).delete()
-                
-                # Delete user account
+                # Delete user account and all stored passwords
                 username = current_user.username
-                db.session.delete(current_user)
+                delete_user(current_user)
                 db.session.commit()
                 
                 # Log out the user
                 logout_user()
                 
                 flash('Your account has been permanently deleted.', 'info')
-                logging.info(f"Account deleted: user={username}")
+                logging.info("Account deleted: user=%s", username)
                 return redirect(url_for('register'))
                 
             except Exception as e:
                 db.session.rollback()
                 flash('An error occurred while deleting account.', 'error')
-                logging.error(f"Account deletion failed: user={current_user.username}, error={str(e)}")
+                logging.error("Account deletion failed: user=%s, error=%s", current_user.username, e)
     
     # Get user statistics for display
-    password_count = Password.query.filter_by(user_id=current_user.id).count()
+    password_count = get_user_password_count(current_user.id)
     
     return render_template('settings.html', 
                          password_count=password_count,
@@ -404,13 +563,10 @@ def not_found_error(error):
 def internal_error(error):
     """Handle 500 errors"""
     db.session.rollback()
-    logging.error(f"Internal server error: {str(error)}")
+    logging.error("Internal server error: %s", error)
     return render_template('500.html'), 500
 
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
-    
     # Run with SSL in production
     if os.getenv('FLASK_ENV') == 'production':
         app.run(
@@ -1,30 +1,156 @@
 """
 Authentication Utilities for Secure Password Manager
-Handles password hashing and verification using bcrypt.
+Handles password hashing and verification using Argon2id.
 """
 
 import bcrypt
+import hashlib
+import hmac
 import logging
+import os
+import re
+import string
+import threading
+import time
+from collections import OrderedDict
 from typing import Union
+from urllib.parse import urlsplit
+from argon2 import PasswordHasher, Type, extract_parameters
+from argon2.exceptions import VerifyMismatchError
 
 # Configure logging for authentication events
 logger = logging.getLogger(__name__)
 
-# bcrypt configuration
-BCRYPT_ROUNDS = 12  # Recommended salt rounds for security vs performance balance
+# Argon2id configuration
+ARGON2_MEMORY_COST = 65536  # KiB (64 MiB)
+ARGON2_PARALLELISM = 2      # Parallel lanes
+ARGON2_HASH_LEN = 32
+ARGON2_SALT_LEN = 16
+
+# Time cost is calibrated once at startup to the host's speed, unless the
+# ARGON2_TIME_COST environment variable pins it (e.g. a cheap value for tests)
+HASH_TARGET_SECONDS = 0.2   # Wall-clock budget for one hash
+ARGON2_MIN_TIME_COST = 2    # OWASP minimum, never calibrated below
+ARGON2_MAX_TIME_COST = 6
+
+
+def calibrate_time_cost(target_seconds: float = HASH_TARGET_SECONDS) -> int:
+    """
+    Pick the Argon2 time cost that best fits a hashing time budget.
+    
+    Args:
+        target_seconds (float): Desired wall-clock time for one hash
+        
+    Returns:
+        int: Time cost clamped to [ARGON2_MIN_TIME_COST, ARGON2_MAX_TIME_COST]
+        
+    Note: Existing hashes keep verifying whatever value is picked, because
+    each hash stores the parameters it was created with.
+    """
+    probe = PasswordHasher(
+        time_cost=1,
+        memory_cost=ARGON2_MEMORY_COST,
+        parallelism=ARGON2_PARALLELISM,
+        hash_len=ARGON2_HASH_LEN,
+        salt_len=ARGON2_SALT_LEN
+    )
+    
+    start = time.perf_counter()
+    probe.hash("calibration-probe")
+    seconds_per_pass = time.perf_counter() - start
+    
+    time_cost = int(target_seconds // seconds_per_pass) if seconds_per_pass > 0 else ARGON2_MAX_TIME_COST
+    return max(ARGON2_MIN_TIME_COST, min(ARGON2_MAX_TIME_COST, time_cost))
+
+
+_time_cost_override = os.environ.get('ARGON2_TIME_COST')
+ARGON2_TIME_COST = max(1, int(_time_cost_override)) if _time_cost_override else calibrate_time_cost()
+
+# Configured once at import; legacy bcrypt hashes are still verified (their
+# cost is stored in the hash) and upgraded on the next successful login
+_password_hasher = PasswordHasher(
+    time_cost=ARGON2_TIME_COST,
+    memory_cost=ARGON2_MEMORY_COST,
+    parallelism=ARGON2_PARALLELISM,
+    hash_len=ARGON2_HASH_LEN,
+    salt_len=ARGON2_SALT_LEN
+)
+
+# Password strength rules
+SPECIAL_CHARS = "!@#$%^&*()_+-=[]{}|;:,.<>?"
+
+# Character class bits for the translate-based classifier
+_CLASS_UPPER = 1
+_CLASS_LOWER = 2
+_CLASS_DIGIT = 4
+_CLASS_SPECIAL = 8
+
+
+def _class_bits(char: str) -> int:
+    """Class bits for a single ASCII character"""
+    bits = 0
+    if char in string.ascii_uppercase:
+        bits |= _CLASS_UPPER
+    if char in string.ascii_lowercase:
+        bits |= _CLASS_LOWER
+    if char in string.digits:
+        bits |= _CLASS_DIGIT
+    if char in SPECIAL_CHARS:
+        bits |= _CLASS_SPECIAL
+    return bits
+
+
+# One byte per possible input byte; non-ASCII bytes map to 0
+_CLASS_TABLE = bytes(_class_bits(chr(i)) if i < 128 else 0 for i in range(256))
+
+# Bytes allowed in a username (deleted by translate; anything left is invalid)
+_USERNAME_BYTES = (string.ascii_letters + string.digits + '_').encode('ascii')
+
+COMMON_PASSWORDS = frozenset({
+    'password', 'password123', '123456', 'qwerty', 'abc123',
+    'password1', 'admin', 'letmein', 'welcome', 'monkey'
+})
+
+# Basic email regex pattern (ASCII-only, compiled once)
+_EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', re.ASCII)
+
+# One DNS label; matched per label so there is no nested repetition to backtrack
+_HOST_LABEL_RE = re.compile(r'[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?', re.ASCII)
+
+# Hash of a random password, verified against when a login names an unknown
+# user so that response time does not reveal which usernames exist
+_DUMMY_HASH = _password_hasher.hash(os.urandom(16).hex())
+
+# Failed-login throttling configuration
+LOGIN_MAX_FAILURES = 5            # Failures allowed per (IP, username) per window
+LOGIN_FAILURE_WINDOW = 60         # Seconds before a failure counter resets
+LOGIN_FAILURE_CACHE_SIZE = 10000  # Maximum number of tracked (IP, username) pairs
+
+_login_failures = OrderedDict()
+_login_failures_lock = threading.Lock()
+
+# Verified-login cache configuration
+VERIFY_CACHE_SIZE = 1024  # Maximum number of remembered successful verifications
+VERIFY_CACHE_TTL = 60     # Seconds a successful verification is remembered
+
+# Per-process pepper so cache keys are never password-equivalent
+_VERIFY_CACHE_PEPPER = os.urandom(32)
+_verify_cache = OrderedDict()
+_verify_cache_lock = threading.Lock()
 
 def hash_password(password: str) -> str:
     """
-    Hash a password using bcrypt with salt.
+    Hash a password using Argon2id with salt.
     
     Args:
         password (str): Plain text password to hash
         
     Returns:
-        str: Base64-encoded bcrypt hash
+        str: Argon2id hash in PHC string format
         
     Security Notes:
-        - Uses 12 salt rounds (recommended for 2024)
+        - Argon2id is memory-hard (64 MiB) and uses parallel lanes
+        - Time cost is calibrated at startup (see calibrate_time_cost)
         - Automatically generates random salt
         - Returns hash as string for database storage
     """
@@ -35,28 +161,20 @@ def hash_password(password: str) -> str:
         raise ValueError("Password must be at least 8 characters long")
     
     try:
-        # Convert password to bytes
-        password_bytes = password.encode('utf-8')
-        
-        # Generate salt and hash password
-        salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
-        hashed = bcrypt.hashpw(password_bytes, salt)
-        
-        # Return as string for database storage
-        return hashed.decode('utf-8')
+        return _password_hasher.hash(password)
         
     except Exception as e:
-        logger.error(f"Password hashing failed: {str(e)}")
+        logger.error("Password hashing failed: %s", e)
         raise RuntimeError("Password hashing failed") from e
 
 
 def verify_password(password: str, password_hash: str) -> bool:
     """
-    Verify a password against its bcrypt hash.
+    Verify a password against its Argon2id (or legacy bcrypt) hash.
     
     Args:
         password (str): Plain text password to verify
-        password_hash (str): Stored bcrypt hash from database
+        password_hash (str): Stored password hash from database
         
     Returns:
         bool: True if password matches, False otherwise
@@ -65,29 +183,189 @@ def verify_password(password: str, password_hash: str) -> bool:
         - Constant-time comparison prevents timing attacks
         - Handles invalid hashes gracefully
         - Logs failed verification attempts
+        - Legacy bcrypt hashes still verify; see needs_rehash()
+        - Successful verifications are cached for VERIFY_CACHE_TTL seconds,
+          keyed by a peppered HMAC so the cache never holds plaintext
     """
     if not password or not password_hash:
         logger.warning("Password or hash is empty during verification")
         return False
     
     try:
-        # Convert to bytes for bcrypt
         password_bytes = password.encode('utf-8')
         hash_bytes = password_hash.encode('utf-8')
         
-        # Verify password using bcrypt's secure comparison
-        result = bcrypt.checkpw(password_bytes, hash_bytes)
+        # Skip the KDF entirely if this pair was verified recently
+        cache_key = _verify_cache_key(password_bytes, hash_bytes)
+        if _verify_cache_lookup(cache_key):
+            return True
         
-        if not result:
+        if _is_bcrypt_hash(password_hash):
+            result = bcrypt.checkpw(password_bytes, hash_bytes)
+        else:
+            try:
+                result = _password_hasher.verify(password_hash, password)
+            except VerifyMismatchError:
+                result = False
+        
+        if result:
+            _verify_cache_store(cache_key)
+        else:
             logger.warning("Password verification failed")
         
         return result
         
     except Exception as e:
-        logger.error(f"Password verification error: {str(e)}")
+        logger.error("Password verification error: %s", e)
         return False
 
 
+def needs_rehash(password_hash: str) -> bool:
+    """
+    Check whether a stored hash should be upgraded to the current parameters.
+    
+    Args:
+        password_hash (str): Stored password hash from database
+        
+    Returns:
+        bool: True for legacy bcrypt hashes or Argon2 parameters weaker
+              than the current configuration
+        
+    Note: Only call after a successful verify_password, then store
+    hash_password(password) in place of the old hash. Hashes stronger than
+    this host's calibrated cost are kept, so hosts calibrating to different
+    time costs never rehash back and forth.
+    """
+    if _is_bcrypt_hash(password_hash):
+        return True
+    
+    try:
+        params = extract_parameters(password_hash)
+    except Exception:
+        return True
+    
+    return (
+        params.type != Type.ID
+        or params.time_cost < ARGON2_TIME_COST
+        or params.memory_cost < ARGON2_MEMORY_COST
+        or params.hash_len < ARGON2_HASH_LEN
+    )
+
+
+def _is_bcrypt_hash(password_hash: str) -> bool:
+    """Legacy bcrypt hashes use the $2a$/$2b$/$2y$ prefixes"""
+    return password_hash.startswith('$2')
+
+
+def _verify_cache_key(password_bytes: bytes, hash_bytes: bytes) -> bytes:
+    """Build a peppered HMAC-SHA256 cache key for a (password, hash) pair"""
+    return hmac.new(_VERIFY_CACHE_PEPPER, password_bytes + b"|" + hash_bytes, hashlib.sha256).digest()
+
+
+def _verify_cache_lookup(cache_key: bytes) -> bool:
+    """Return True if the key was verified within the last VERIFY_CACHE_TTL seconds"""
+    with _verify_cache_lock:
+        expires_at = _verify_cache.get(cache_key)
+        if expires_at is None:
+            return False
+        if expires_at < time.monotonic():
+            del _verify_cache[cache_key]
+            return False
+        _verify_cache.move_to_end(cache_key)
+        return True
+
+
+def _verify_cache_store(cache_key: bytes) -> None:
+    """Remember a successful verification, evicting the least recently used entry"""
+    with _verify_cache_lock:
+        _verify_cache[cache_key] = time.monotonic() + VERIFY_CACHE_TTL
+        _verify_cache.move_to_end(cache_key)
+        while len(_verify_cache) > VERIFY_CACHE_SIZE:
+            _verify_cache.popitem(last=False)
+
+
+def clear_verification_cache() -> None:
+    """
+    Forget all cached successful verifications.
+    
+    Must be called whenever a stored password hash changes so a stale
+    credential can never be accepted from the cache.
+    """
+    with _verify_cache_lock:
+        _verify_cache.clear()
+
+
+def verify_dummy_password(password: str) -> None:
+    """
+    Spend the same work as a real verification for an unknown username.
+    
+    Args:
+        password (str): Submitted password (never matches)
+    """
+    if password:
+        try:
+            _password_hasher.verify(_DUMMY_HASH, password)
+        except VerifyMismatchError:
+            pass
+
+
+def is_login_throttled(ip_address: str, username: str) -> bool:
+    """
+    Check whether a client has exhausted its failed-login allowance.
+    
+    Args:
+        ip_address (str): Client IP address
+        username (str): Attempted username
+        
+    Returns:
+        bool: True if LOGIN_MAX_FAILURES failures occurred within the window,
+              in which case the password should not be verified at all
+    """
+    key = (ip_address, username)
+    with _login_failures_lock:
+        entry = _login_failures.get(key)
+        if entry is None:
+            return False
+        failures, expires_at = entry
+        if expires_at < time.monotonic():
+            del _login_failures[key]
+            return False
+        return failures >= LOGIN_MAX_FAILURES
+
+
+def record_failed_login(ip_address: str, username: str) -> None:
+    """Count a failed login for an (IP, username) pair"""
+    key = (ip_address, username)
+    now = time.monotonic()
+    with _login_failures_lock:
+        failures, expires_at = _login_failures.get(key, (0, 0))
+        if expires_at < now:
+            failures, expires_at = 0, now + LOGIN_FAILURE_WINDOW
+        _login_failures[key] = (failures + 1, expires_at)
+        _login_failures.move_to_end(key)
+        while len(_login_failures) > LOGIN_FAILURE_CACHE_SIZE:
+            _login_failures.popitem(last=False)
+
+
+def reset_failed_logins(ip_address: str, username: str) -> None:
+    """Forget failed logins for an (IP, username) pair after a successful login"""
+    with _login_failures_lock:
+        _login_failures.pop((ip_address, username), None)
+
+
+def _char_classes(text: str) -> int:
+    """
+    Bitwise OR of the class bits of every character in text.
+    
+    str.encode + bytes.translate run in C over the whole string; only the
+    handful of distinct class values is then folded in Python.
+    """
+    seen = 0
+    for bits in set(text.encode('utf-8', 'ignore').translate(_CLASS_TABLE)):
+        seen |= bits
+    return seen
+
+
 def is_password_strong(password: str) -> tuple[bool, list[str]]:
     """
     Check if a password meets security requirements.
@@ -114,26 +392,23 @@ def is_password_strong(password: str) -> tuple[bool, list[str]]:
     if len(password) > 128:
         issues.append("Password must be less than 128 characters")
     
-    if not any(c.isupper() for c in password):
+    # Classify every character in one C-level translate pass
+    seen = _char_classes(password)
+    
+    if not seen & _CLASS_UPPER:
         issues.append("Password must contain at least one uppercase letter")
     
-    if not any(c.islower() for c in password):
+    if not seen & _CLASS_LOWER:
         issues.append("Password must contain at least one lowercase letter")
     
-    if not any(c.isdigit() for c in password):
+    if not seen & _CLASS_DIGIT:
         issues.append("Password must contain at least one digit")
     
-    special_chars = "!@#$%^&*()_+-=[]{}|;:,.<>?"
-    if not any(c in special_chars for c in password):
+    if not seen & _CLASS_SPECIAL:
         issues.append("Password must contain at least one special character")
     
     # Check against common passwords
-    common_passwords = {
-        'password', 'password123', '123456', 'qwerty', 'abc123',
-        'password1', 'admin', 'letmein', 'welcome', 'monkey'
-    }
-    
-    if password.lower() in common_passwords:
+    if password.lower() in COMMON_PASSWORDS:
         issues.append("Password is too common")
     
     return len(issues) == 0, issues
@@ -155,7 +430,6 @@ def generate_secure_password(length: int = 16) -> str:
         - Avoids ambiguous characters (0, O, l, 1)
     """
     import secrets
-    import string
     
     if length < 12:
         raise ValueError("Password length must be at least 12 characters")
@@ -207,8 +481,8 @@ def validate_username(username: str) -> tuple[bool, list[str]]:
     if len(username) > 30:
         issues.append("Username must be less than 30 characters")
     
-    # Allow alphanumeric and underscore only
-    if not username.replace('_', '').isalnum():
+    # Allow ASCII alphanumeric and underscore only
+    if not username.isascii() or username.encode('ascii').translate(None, _USERNAME_BYTES):
         issues.append("Username can only contain letters, numbers, and underscores")
     
     # Must start with letter
@@ -228,21 +502,71 @@ def validate_email(email: str) -> tuple[bool, list[str]]:
     Returns:
         tuple: (is_valid: bool, issues: list[str])
     """
-    import re
-    
     issues = []
     
     if not email:
         issues.append("Email cannot be empty")
         return False, issues
     
-    # Basic email regex pattern
-    email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    
-    if not re.match(email_pattern, email):
+    if not _EMAIL_RE.match(email):
         issues.append("Invalid email format")
     
     if len(email) > 254:
         issues.append("Email address is too long")
     
     return len(issues) == 0, issues
+
+
+def _is_valid_host(host: str) -> bool:
+    """Accept localhost, a dotted-quad IPv4 address, or a domain with an alphabetic TLD"""
+    if host == 'localhost':
+        return True
+    
+    labels = host[:-1].split('.') if host.endswith('.') else host.split('.')
+    if len(labels) == 4 and all(label.isdigit() and len(label) <= 3 for label in labels):
+        return True
+    
+    tld = labels[-1]
+    return (
+        len(labels) >= 2
+        and tld.isascii() and tld.isalpha() and 2 <= len(tld) <= 6
+        and all(_HOST_LABEL_RE.fullmatch(label) for label in labels)
+    )
+
+
+def validate_url(url: str) -> tuple[bool, list[str]]:
+    """
+    Validate a stored entry's website URL.
+    
+    Args:
+        url (str): URL to validate
+        
+    Returns:
+        tuple: (is_valid: bool, issues: list[str])
+        
+    Note: Parsed with urllib.parse.urlsplit rather than one large regex, so
+    validation time stays linear in the input length.
+    """
+    issues = []
+    
+    if not url:
+        issues.append("URL cannot be empty")
+        return False, issues
+    
+    try:
+        parts = urlsplit(url)
+        parts.port  # raises ValueError for a non-numeric or out-of-range port
+    except ValueError:
+        issues.append("Invalid URL format")
+        return False, issues
+    
+    if parts.scheme.lower() not in ('http', 'https'):
+        issues.append("URL must start with http:// or https://")
+    
+    if url.split() != [url]:
+        issues.append("URL cannot contain whitespace")
+    
+    if parts.username is not None or not parts.hostname or not _is_valid_host(parts.hostname):
+        issues.append("Invalid URL host")
+    
+    return len(issues) == 0, issues
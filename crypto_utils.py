@@ -1,31 +1,99 @@
 """
 Cryptographic Utilities for Secure Password Manager
 Handles AES encryption and decryption of stored passwords.
+
+Requires a cryptography wheel linked against OpenSSL >= 1.1.1 so AES-GCM
+runs on AES-NI/PCLMUL; check_aes_acceleration() warns at import otherwise.
 """
 
-import base64
+import hmac
+import os
 import secrets
 import logging
-from typing import Union
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Iterable, Iterator, List, Optional, Union
+from argon2.low_level import Type, hash_secret_raw
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.backends.openssl.backend import backend as openssl_backend
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
 # Encryption constants
 AES_KEY_SIZE = 32  # 256 bits
-IV_SIZE = 16       # 128 bits for AES-GCM
+IV_SIZE = 12       # 96 bits, the GCM-native nonce size
+LEGACY_IV_SIZE = 16  # IV length of entries written before FORMAT_ARGON2ID_IV12
 TAG_SIZE = 16      # 128 bits for GCM authentication tag
-SALT_SIZE = 32     # 256 bits for PBKDF2 salt
-PBKDF2_ITERATIONS = 100000  # OWASP recommended minimum
+SALT_SIZE = 32     # 256 bits for key derivation salts
+PBKDF2_ITERATIONS = 100000  # Legacy KDF, kept to read older entries
+
+# Vault key derivation (Argon2id, OWASP minimum configuration)
+KDF_TIME_COST = 2
+KDF_MEMORY_COST = 19456  # KiB (19 MiB)
+KDF_PARALLELISM = 1
+
+# Leading format byte of a stored entry; it names the KDF behind the vault key and the IV length
+FORMAT_PBKDF2 = b'\x01'         # vault key from PBKDF2-HMAC-SHA256, 16-byte IV
+FORMAT_ARGON2ID = b'\x02'       # vault key from Argon2id, 16-byte IV
+FORMAT_ARGON2ID_IV12 = b'\x03'  # vault key from Argon2id, 12-byte IV
+BLOB_VERSION = FORMAT_ARGON2ID_IV12  # Format written by encrypt_password
+FORMAT_IV_SIZES = {FORMAT_PBKDF2: LEGACY_IV_SIZE, FORMAT_ARGON2ID: LEGACY_IV_SIZE, FORMAT_ARGON2ID_IV12: IV_SIZE}
+VAULT_KEY_FORMATS = (FORMAT_ARGON2ID, FORMAT_ARGON2ID_IV12)  # Readable with the current vault key
+
+# Key rotation fan-out; smaller vaults are rotated inline, where threads cost more than they save
+ROTATE_MAX_WORKERS = os.cpu_count() or 1
+ROTATE_PARALLEL_THRESHOLD = 64
+
+# Import-time AES-GCM self-test
+AES_SELF_TEST_BYTES = 1 << 20  # 1 MiB
+AES_SELF_TEST_RUNS = 3
+AES_MIN_THROUGHPUT = 500  # MiB/s; hardware AES-GCM clears this many times over
+
+
+def check_aes_acceleration() -> float:
+    """
+    Measure AES-256-GCM throughput and warn if it looks like software AES.
+    
+    Returns:
+        float: Measured throughput in MiB/s (0.0 if the self-test failed)
+        
+    Note: Without AES-NI/PCLMUL, OpenSSL falls back to table or bit-sliced
+    AES and every vault operation gets several times slower with no error.
+    """
+    try:
+        aead = AESGCM(os.urandom(AES_KEY_SIZE))
+        payload = bytes(AES_SELF_TEST_BYTES)
+        aead.encrypt(os.urandom(IV_SIZE), b"warmup", None)
+        
+        # Best of a few runs so a scheduler hiccup doesn't trigger the warning
+        elapsed_ns = None
+        for _ in range(AES_SELF_TEST_RUNS):
+            start = time.perf_counter_ns()
+            aead.encrypt(os.urandom(IV_SIZE), payload, None)
+            run_ns = max(time.perf_counter_ns() - start, 1)
+            elapsed_ns = run_ns if elapsed_ns is None else min(elapsed_ns, run_ns)
+    except Exception as e:
+        logger.error("AES-GCM self-test failed: %s", e)
+        return 0.0
+    
+    mibps = (AES_SELF_TEST_BYTES / (1 << 20)) / (elapsed_ns / 1e9)
+    logger.info("AES-GCM self-test: %.0f MiB/s (%s)", mibps, openssl_backend.openssl_version_text())
+    if mibps < AES_MIN_THROUGHPUT:
+        logger.warning("AES-NI appears disabled: %.0f MiB/s", mibps)
+    
+    return mibps
+
+
+AES_THROUGHPUT = check_aes_acceleration()
 
 
 def derive_key_from_master(master_key: str, salt: bytes) -> bytes:
     """
-    Derive encryption key from master key using PBKDF2.
+    Derive encryption key from master key using Argon2id.
     
     Args:
         master_key (str): User's master encryption key
@@ -35,9 +103,41 @@ def derive_key_from_master(master_key: str, salt: bytes) -> bytes:
         bytes: Derived 256-bit encryption key
         
     Security Notes:
-        - Uses PBKDF2 with SHA-256 and 100,000 iterations
+        - Argon2id, t=2, m=19 MiB, p=1 (OWASP minimum)
+        - Memory hardness resists GPU/ASIC brute force
         - Salt prevents rainbow table attacks
-        - Key stretching increases brute force difficulty
+    """
+    if not master_key:
+        raise ValueError("Master key cannot be empty")
+    
+    try:
+        return hash_secret_raw(
+            master_key.encode('utf-8'),
+            salt,
+            time_cost=KDF_TIME_COST,
+            memory_cost=KDF_MEMORY_COST,
+            parallelism=KDF_PARALLELISM,
+            hash_len=AES_KEY_SIZE,
+            type=Type.ID
+        )
+        
+    except Exception as e:
+        logger.error("Key derivation failed: %s", e)
+        raise RuntimeError("Key derivation failed") from e
+
+
+def derive_pbkdf2_key(master_key: str, salt: bytes) -> bytes:
+    """
+    Derive encryption key from master key using PBKDF2.
+    
+    Args:
+        master_key (str): User's master encryption key
+        salt (bytes): Random salt for key derivation
+        
+    Returns:
+        bytes: Derived 256-bit encryption key
+        
+    Note: Only used to read entries written before the Argon2id vault key.
     """
     if not master_key:
         raise ValueError("Master key cannot be empty")
@@ -51,84 +151,156 @@ def derive_key_from_master(master_key: str, salt: bytes) -> bytes:
             algorithm=hashes.SHA256(),
             length=AES_KEY_SIZE,
             salt=salt,
-            iterations=PBKDF2_ITERATIONS,
-            backend=default_backend()
+            iterations=PBKDF2_ITERATIONS
         )
         
         # Derive and return the key
         return kdf.derive(master_key_bytes)
         
     except Exception as e:
-        logger.error(f"Key derivation failed: {str(e)}")
+        logger.error("Key derivation failed: %s", e)
         raise RuntimeError("Key derivation failed") from e
 
 
-def encrypt_password(plaintext_password: str, master_key: str) -> str:
+def derive_master_key_once(master_key: str, user_salt: bytes) -> bytes:
+    """
+    Derive a user's vault key, once per login/request.
+    
+    Args:
+        master_key (str): User's master encryption key
+        user_salt (bytes): Per-user salt stored in the users table
+        
+    Returns:
+        bytes: 256-bit vault key used directly for every entry's AES-GCM
+        
+    Security Notes:
+        - One Argon2id run covers the whole vault instead of one per entry
+        - Callers keep the result in request context, never in storage
+    """
+    if not user_salt or len(user_salt) != SALT_SIZE:
+        raise ValueError("User salt must be %d bytes" % SALT_SIZE)
+    
+    return derive_key_from_master(master_key, user_salt)
+
+
+def _check_key(key: bytes) -> None:
+    """Reject anything that is not a 256-bit derived key"""
+    if not key:
+        raise ValueError("Encryption key cannot be empty")
+    
+    if not isinstance(key, bytes) or len(key) != AES_KEY_SIZE:
+        raise ValueError("Encryption key must be %d bytes" % AES_KEY_SIZE)
+
+
+def encrypt_password(plaintext_password: str, key: bytes) -> bytes:
     """
     Encrypt a password using AES-256-GCM.
     
     Args:
         plaintext_password (str): Password to encrypt
-        master_key (str): User's master encryption key
+        key (bytes): Vault key from derive_master_key_once
         
     Returns:
-        str: Base64-encoded encrypted data (salt + iv + tag + ciphertext)
+        bytes: Encrypted data (version + iv + tag + ciphertext), stored as-is
         
     Security Features:
         - AES-256-GCM for authenticated encryption
         - Random IV for each encryption
-        - PBKDF2 key derivation from master key
+        - Key derived once per user, not per entry
         - Authenticated encryption prevents tampering
     """
     if not plaintext_password:
         raise ValueError("Password cannot be empty")
     
-    if not master_key:
-        raise ValueError("Master key cannot be empty")
+    _check_key(key)
     
     try:
-        # Generate random salt and IV
-        salt = secrets.token_bytes(SALT_SIZE)
-        iv = secrets.token_bytes(IV_SIZE)
-        
-        # Derive encryption key from master key
-        key = derive_key_from_master(master_key, salt)
+        # Generate random IV
+        iv = os.urandom(IV_SIZE)
         
         # Convert password to bytes
         password_bytes = plaintext_password.encode('utf-8')
         
-        # Create AES-GCM cipher
-        cipher = Cipher(
-            algorithms.AES(key),
-            modes.GCM(iv),
-            backend=default_backend()
-        )
-        encryptor = cipher.encryptor()
+        # Encrypt in one call; AESGCM returns ciphertext + tag
+        sealed = AESGCM(key).encrypt(iv, password_bytes, None)
+        ciphertext, tag = sealed[:-TAG_SIZE], sealed[-TAG_SIZE:]
+        
+        # Combine version + iv + tag + ciphertext
+        return BLOB_VERSION + iv + tag + ciphertext
+        
+    except Exception as e:
+        logger.error("Password encryption failed: %s", e)
+        raise RuntimeError("Password encryption failed") from e
+
+
+def decrypt_password(encrypted_password: bytes, key: bytes) -> str:
+    """
+    Decrypt a password using AES-256-GCM.
+    
+    Args:
+        encrypted_password (bytes): Encrypted password as stored
+        key (bytes): Vault key from derive_master_key_once
+        
+    Returns:
+        str: Decrypted plaintext password
+        
+    Raises:
+        ValueError: If decryption fails or data is corrupted
+        RuntimeError: If cryptographic operation fails
+    """
+    if not encrypted_password:
+        raise ValueError("Encrypted password cannot be empty")
+    
+    _check_key(key)
+    
+    return _decrypt_with(AESGCM(key), encrypted_password)
+
+
+def _decrypt_with(aead: AESGCM, encrypted_data: bytes, formats: tuple = VAULT_KEY_FORMATS) -> str:
+    """Decrypt one versioned blob with an already-constructed AESGCM instance"""
+    try:
+        # Verify format byte and minimum length
+        version = encrypted_data[:1]
+        if version not in formats:
+            raise ValueError("Invalid encrypted data format")
         
-        # Encrypt the password
-        ciphertext = encryptor.update(password_bytes) + encryptor.finalize()
+        iv_size = FORMAT_IV_SIZES[version]
+        if len(encrypted_data) < 1 + iv_size + TAG_SIZE:
+            raise ValueError("Invalid encrypted data format")
         
-        # Get authentication tag
-        tag = encryptor.tag
+        # Extract components
+        iv = encrypted_data[1:1 + iv_size]
+        tag = encrypted_data[1 + iv_size:1 + iv_size + TAG_SIZE]
+        ciphertext = encrypted_data[1 + iv_size + TAG_SIZE:]
         
-        # Combine salt + iv + tag + ciphertext
-        encrypted_data = salt + iv + tag + ciphertext
+        # Decrypt and verify authentication in one call
+        plaintext_bytes = aead.decrypt(iv, ciphertext + tag, None)
         
-        # Return as base64-encoded string
-        return base64.b64encode(encrypted_data).decode('utf-8')
+        # Convert back to string
+        return plaintext_bytes.decode('utf-8')
         
+    except ValueError as e:
+        logger.warning("Password decryption failed - invalid data: %s", e)
+        raise ValueError("Invalid encrypted password data") from e
     except Exception as e:
-        logger.error(f"Password encryption failed: {str(e)}")
-        raise RuntimeError("Password encryption failed") from e
+        logger.error("Password decryption failed: %s", e)
+        raise RuntimeError("Password decryption failed") from e
 
 
-def decrypt_password(encrypted_password: str, master_key: str) -> str:
+def decrypt_legacy_password(encrypted_password: bytes, master_key: str, user_salt: Optional[bytes] = None,
+                            legacy_key: Optional[bytes] = None) -> str:
     """
-    Decrypt a password using AES-256-GCM.
+    Decrypt a blob written by an older format.
+    
+    Handles FORMAT_PBKDF2 entries (PBKDF2 vault key, needs user_salt) and
+    entries from before vault keys (salt + iv + tag + ciphertext).
     
     Args:
-        encrypted_password (str): Base64-encoded encrypted password
+        encrypted_password (bytes): Legacy encrypted password as stored
         master_key (str): User's master encryption key
+        user_salt (bytes, optional): Per-user salt stored in the users table
+        legacy_key (bytes, optional): derive_pbkdf2_key(master_key, user_salt),
+                                      if the caller already has it
         
     Returns:
         str: Decrypted plaintext password
@@ -144,56 +316,135 @@ def decrypt_password(encrypted_password: str, master_key: str) -> str:
         raise ValueError("Master key cannot be empty")
     
     try:
-        # Decode from base64
-        encrypted_data = base64.b64decode(encrypted_password.encode('utf-8'))
+        encrypted_data = encrypted_password
+        
+        # PBKDF2 vault key; a per-entry salt may start with the same byte
+        if user_salt and encrypted_data[:len(FORMAT_PBKDF2)] == FORMAT_PBKDF2:
+            try:
+                aead = AESGCM(legacy_key or derive_pbkdf2_key(master_key, user_salt))
+                return _decrypt_with(aead, encrypted_password, (FORMAT_PBKDF2,))
+            except (ValueError, RuntimeError):
+                pass
         
         # Verify minimum length
-        min_length = SALT_SIZE + IV_SIZE + TAG_SIZE
+        min_length = SALT_SIZE + LEGACY_IV_SIZE + TAG_SIZE
         if len(encrypted_data) < min_length:
             raise ValueError("Invalid encrypted data format")
         
         # Extract components
         salt = encrypted_data[:SALT_SIZE]
-        iv = encrypted_data[SALT_SIZE:SALT_SIZE + IV_SIZE]
-        tag = encrypted_data[SALT_SIZE + IV_SIZE:SALT_SIZE + IV_SIZE + TAG_SIZE]
-        ciphertext = encrypted_data[SALT_SIZE + IV_SIZE + TAG_SIZE:]
-        
-        # Derive decryption key
-        key = derive_key_from_master(master_key, salt)
-        
-        # Create AES-GCM cipher for decryption
-        cipher = Cipher(
-            algorithms.AES(key),
-            modes.GCM(iv, tag),
-            backend=default_backend()
-        )
-        decryptor = cipher.decryptor()
+        iv = encrypted_data[SALT_SIZE:SALT_SIZE + LEGACY_IV_SIZE]
+        tag = encrypted_data[SALT_SIZE + LEGACY_IV_SIZE:SALT_SIZE + LEGACY_IV_SIZE + TAG_SIZE]
+        ciphertext = encrypted_data[SALT_SIZE + LEGACY_IV_SIZE + TAG_SIZE:]
         
-        # Decrypt and verify authentication
-        plaintext_bytes = decryptor.update(ciphertext) + decryptor.finalize()
+        # Derive the per-entry key
+        key = derive_pbkdf2_key(master_key, salt)
+        
+        # Decrypt and verify authentication in one call
+        plaintext_bytes = AESGCM(key).decrypt(iv, ciphertext + tag, None)
         
-        # Convert back to string
         return plaintext_bytes.decode('utf-8')
         
     except ValueError as e:
-        logger.warning(f"Password decryption failed - invalid data: {str(e)}")
+        logger.warning("Legacy password decryption failed - invalid data: %s", e)
         raise ValueError("Invalid encrypted password data") from e
     except Exception as e:
-        logger.error(f"Password decryption failed: {str(e)}")
+        logger.error("Legacy password decryption failed: %s", e)
         raise RuntimeError("Password decryption failed") from e
 
 
-def change_password_encryption(old_encrypted: str, old_master_key: str, new_master_key: str) -> str:
+def rewrap_legacy_password(encrypted_password: bytes, master_key: str, user_salt: bytes,
+                           key: bytes, legacy_key: Optional[bytes] = None) -> Optional[bytes]:
     """
-    Re-encrypt a password with a new master key.
+    Re-encrypt a blob in any older format under the current vault key and format.
     
     Args:
-        old_encrypted (str): Password encrypted with old master key
-        old_master_key (str): Current master key
-        new_master_key (str): New master key
+        encrypted_password (bytes): Stored encrypted password
+        master_key (str): User's master encryption key
+        user_salt (bytes): Per-user salt stored in the users table
+        key (bytes): Vault key from derive_master_key_once
+        legacy_key (bytes, optional): derive_pbkdf2_key(master_key, user_salt),
+                                      if the caller already has it
         
     Returns:
-        str: Password encrypted with new master key
+        Optional[bytes]: The rewrapped blob, or None if the entry already
+                       uses the current format
+        
+    Note: Legacy and current blobs overlap in length, so an entry is treated
+    as legacy only when it fails to authenticate under the vault key.
+    """
+    if encrypted_password[:1] == BLOB_VERSION:
+        try:
+            decrypt_password(encrypted_password, key)
+            return None
+        except (ValueError, RuntimeError):
+            pass
+    
+    try:
+        # Older layout under the same vault key (e.g. 16-byte IV)
+        plaintext = decrypt_password(encrypted_password, key)
+    except (ValueError, RuntimeError):
+        plaintext = decrypt_legacy_password(encrypted_password, master_key, user_salt, legacy_key)
+    
+    return encrypt_password(plaintext, key)
+
+
+def decrypt_password_batch(encrypted_passwords: Iterable[bytes], key: bytes,
+                           legacy_master_key: Optional[str] = None,
+                           user_salt: Optional[bytes] = None) -> Iterator[Optional[str]]:
+    """
+    Decrypt many passwords encrypted under the same vault key.
+    
+    Args:
+        encrypted_passwords (Iterable[bytes]): Encrypted passwords as stored
+        key (bytes): Vault key from derive_master_key_once
+        legacy_master_key (str, optional): Master key to fall back to for
+                                           entries not yet rewrapped
+        user_salt (bytes, optional): Per-user salt for legacy vault-key entries
+        
+    Returns:
+        Iterator: Decrypted passwords in input order, produced lazily; None
+                  for entries that failed to decrypt (corrupted or tampered data)
+        
+    Note: The key is validated and expanded once, up front, for the whole
+    batch. Entries are decrypted only as they are consumed, and a bad
+    entry never aborts the rest of the batch.
+    """
+    _check_key(key)
+    
+    aead = AESGCM(key)
+    return (_decrypt_or_none(aead, encrypted_password, legacy_master_key, user_salt)
+            for encrypted_password in encrypted_passwords)
+
+
+def _decrypt_or_none(aead: AESGCM, encrypted_password: bytes,
+                     legacy_master_key: Optional[str], user_salt: Optional[bytes]) -> Optional[str]:
+    """Decrypt one batch entry, mapping decryption failures to None"""
+    try:
+        return _decrypt_with(aead, encrypted_password)
+    except (ValueError, RuntimeError):
+        pass
+    
+    if legacy_master_key:
+        try:
+            return decrypt_legacy_password(encrypted_password, legacy_master_key, user_salt)
+        except (ValueError, RuntimeError):
+            pass
+    
+    return None
+
+
+def change_password_encryption(old_encrypted: bytes, old_key: bytes, new_key: bytes) -> bytes:
+    """
+    Re-encrypt a password with a new vault key.
+    
+    Args:
+        old_encrypted (bytes): Password encrypted with old vault key
+        old_key (bytes): Current vault key
+        new_key (bytes): New vault key
+        
+    Returns:
+        bytes: Password encrypted with new vault key
         
     Security Notes:
         - Used when user changes master password
@@ -202,10 +453,10 @@ def change_password_encryption(old_encrypted: str, old_master_key: str, new_mast
     """
     try:
         # Decrypt with old key
-        plaintext = decrypt_password(old_encrypted, old_master_key)
+        plaintext = decrypt_password(old_encrypted, old_key)
         
         # Encrypt with new key
-        new_encrypted = encrypt_password(plaintext, new_master_key)
+        new_encrypted = encrypt_password(plaintext, new_key)
         
         # Clear plaintext from memory (Python limitation)
         plaintext = None
@@ -213,10 +464,39 @@ def change_password_encryption(old_encrypted: str, old_master_key: str, new_mast
         return new_encrypted
         
     except Exception as e:
-        logger.error(f"Password re-encryption failed: {str(e)}")
+        logger.error("Password re-encryption failed: %s", e)
         raise RuntimeError("Password re-encryption failed") from e
 
 
+def rotate_all(encrypted_passwords: Iterable[bytes], old_key: bytes, new_key: bytes) -> List[bytes]:
+    """
+    Re-encrypt every entry of a vault from one vault key to another.
+    
+    Args:
+        encrypted_passwords (Iterable[bytes]): Entries encrypted with old_key
+        old_key (bytes): Current vault key
+        new_key (bytes): New vault key
+        
+    Returns:
+        List[bytes]: Entries encrypted with new_key, in input order
+        
+    Note: Both keys are derived once by the caller, so workers only do
+    AES-GCM, which runs in native code outside the GIL. Vaults of at least
+    ROTATE_PARALLEL_THRESHOLD entries are spread over a thread pool.
+    """
+    _check_key(old_key)
+    _check_key(new_key)
+    
+    entries = list(encrypted_passwords)
+    rotate = partial(change_password_encryption, old_key=old_key, new_key=new_key)
+    
+    if len(entries) < ROTATE_PARALLEL_THRESHOLD or ROTATE_MAX_WORKERS == 1:
+        return [rotate(entry) for entry in entries]
+    
+    with ThreadPoolExecutor(max_workers=ROTATE_MAX_WORKERS) as executor:
+        return list(executor.map(rotate, entries))
+
+
 def generate_encryption_key() -> str:
     """
     Generate a cryptographically secure master encryption key.
@@ -232,13 +512,13 @@ def generate_encryption_key() -> str:
     return secrets.token_hex(32)  # 32 bytes = 256 bits
 
 
-def verify_encryption_integrity(encrypted_password: str, master_key: str) -> bool:
+def verify_encryption_integrity(encrypted_password: bytes, key: bytes) -> bool:
     """
     Verify that encrypted password can be decrypted without corruption.
     
     Args:
-        encrypted_password (str): Encrypted password to verify
-        master_key (str): Master encryption key
+        encrypted_password (bytes): Encrypted password to verify
+        key (bytes): Vault key from derive_master_key_once
         
     Returns:
         bool: True if password can be decrypted successfully
@@ -246,35 +526,33 @@ def verify_encryption_integrity(encrypted_password: str, master_key: str) -> boo
     Note: This is useful for data integrity checks but should be used sparingly
     """
     try:
-        decrypt_password(encrypted_password, master_key)
+        decrypt_password(encrypted_password, key)
         return True
     except Exception:
         return False
 
 
-def secure_compare(a: str, b: str) -> bool:
+def secure_compare(a: Union[str, bytes], b: Union[str, bytes]) -> bool:
     """
     Constant-time string comparison to prevent timing attacks.
     
     Args:
-        a (str): First string
-        b (str): Second string
+        a (str | bytes): First value
+        b (str | bytes): Second value
         
     Returns:
-        bool: True if strings are equal
+        bool: True if values are equal
         
     Security Notes:
-        - Prevents timing attacks on password/token comparison
-        - Always compares full length regardless of differences
+        - Delegates to hmac.compare_digest (constant-time, implemented in C)
+        - str values are UTF-8 encoded first; compare_digest rejects non-ASCII str
     """
-    if len(a) != len(b):
-        return False
-    
-    result = 0
-    for x, y in zip(a, b):
-        result |= ord(x) ^ ord(y)
+    if isinstance(a, str):
+        a = a.encode('utf-8')
+    if isinstance(b, str):
+        b = b.encode('utf-8')
     
-    return result == 0
+    return hmac.compare_digest(a, b)
 
 
 class EncryptionError(Exception):
@@ -7,9 +7,8 @@ from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, TextAreaField, BooleanField, SubmitField
 from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError, Optional
 from wtforms.widgets import PasswordInput
-import re
-from auth import is_password_strong, validate_username, validate_email
-from models import get_user_by_username, get_user_by_email
+from auth import is_password_strong, validate_username, validate_email, validate_url
+from models import get_accounts_matching
 
 
 class LoginForm(FlaskForm):
@@ -95,6 +94,14 @@ class RegisterForm(FlaskForm):
     
     submit = SubmitField('Register')
     
+    _accounts = None
+    
+    def _existing_accounts(self):
+        """Accounts already using the submitted username or email, queried once per form"""
+        if self._accounts is None:
+            self._accounts = get_accounts_matching(self.username.data, self.email.data)
+        return self._accounts
+    
     def validate_username(self, username):
         """Custom validation for username requirements"""
         # Check username format
@@ -103,7 +110,7 @@ class RegisterForm(FlaskForm):
             raise ValidationError('; '.join(issues))
         
         # Check if username already exists
-        if get_user_by_username(username.data):
+        if any(account.username == username.data for account in self._existing_accounts()):
             raise ValidationError('Username already exists. Please choose a different one.')
     
     def validate_email(self, email):
@@ -114,7 +121,7 @@ class RegisterForm(FlaskForm):
             raise ValidationError('; '.join(issues))
         
         # Check if email already exists
-        if get_user_by_email(email.data):
+        if any(account.email == email.data for account in self._existing_accounts()):
             raise ValidationError('Email already registered. Please use a different email.')
     
     def validate_password(self, password):
@@ -186,15 +193,8 @@ class PasswordForm(FlaskForm):
         """Custom validation for URL format"""
         if url.data:
             # Basic URL validation
-            url_pattern = re.compile(
-                r'^https?://'  # http:// or https://
-                r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+[A-Z]{2,6}\.?|'  # domain...
-                r'localhost|'  # localhost...
-                r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # ...or ip
-                r'(?::\d+)?'  # optional port
-                r'(?:/?|[/?]\S+)$', re.IGNORECASE)
-            
-            if not url_pattern.match(url.data):
+            is_valid, _ = validate_url(url.data)
+            if not is_valid:
                 raise ValidationError('Please enter a valid URL (e.g., https://example.com)')
 
 
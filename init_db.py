@@ -8,11 +8,17 @@ import os
 import sys
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# Database location, resolved once (relative to this file so it works on any system)
+basedir = os.path.abspath(os.path.dirname(__file__))
+instance_dir = os.path.join(basedir, 'instance')
+database_uri = os.getenv('DATABASE_URL', f'sqlite:///{os.path.join(instance_dir, "password_manager.db")}')
+
 def init_database():
     """Initialize the database with all required tables"""
     
@@ -20,21 +26,19 @@ def init_database():
     app = Flask(__name__)
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key')
     
-    # Use relative path that works on any system
-    basedir = os.path.abspath(os.path.dirname(__file__))
-    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', f'sqlite:///{os.path.join(basedir, "instance", "password_manager.db")}')
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     
     # Ensure instance directory exists
-    instance_dir = os.path.join(basedir, 'instance')
     os.makedirs(instance_dir, exist_ok=True)
     
-    # Initialize database
+    # Initialize database; importing the listener applies the app's SQLite pragmas here too
+    from models import set_sqlite_pragmas  # noqa: F401
     db = SQLAlchemy(app)
     
     # Define models here to avoid import issues
     from flask_login import UserMixin
-    from datetime import datetime, timezone
+    from sqlalchemy import func
     import secrets
     
     class User(UserMixin, db.Model):
@@ -44,21 +48,26 @@ def init_database():
         email = db.Column(db.String(120), unique=True, nullable=False, index=True)
         password_hash = db.Column(db.String(128), nullable=False)
         encryption_key = db.Column(db.String(64), nullable=False, default=lambda: secrets.token_hex(32))
-        created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+        key_salt = db.Column(db.LargeBinary(32), nullable=False, default=lambda: secrets.token_bytes(32))
+        created_at = db.Column(db.DateTime, default=func.now(), server_default=func.now(), nullable=False)
         last_login = db.Column(db.DateTime)
-        passwords = db.relationship('Password', backref='user', lazy=True, cascade='all, delete-orphan')
+        passwords = db.relationship('Password', backref='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
     
     class Password(db.Model):
         __tablename__ = 'passwords'
         id = db.Column(db.Integer, primary_key=True)
-        user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+        user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
         service = db.Column(db.String(100), nullable=False)
         username = db.Column(db.String(100), nullable=False)
         url = db.Column(db.String(200))
         notes = db.Column(db.Text)
-        encrypted_password = db.Column(db.Text, nullable=False)
-        created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
-        updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+        encrypted_password = db.Column(db.LargeBinary, nullable=False)
+        created_at = db.Column(db.DateTime, default=func.now(), server_default=func.now(), nullable=False)
+        updated_at = db.Column(db.DateTime, default=func.now(), server_default=func.now(), onupdate=func.now(), nullable=False)
+        
+        __table_args__ = (
+            db.Index('ix_pw_user_service', 'user_id', 'service'),
+        )
     
     try:
         with app.app_context():
@@ -80,10 +89,7 @@ def init_database():
 def check_database():
     """Check if database exists and is properly configured"""
     
-    # Use relative path that works on any system
-    basedir = os.path.abspath(os.path.dirname(__file__))
-    default_db_path = f'sqlite:///{os.path.join(basedir, "instance", "password_manager.db")}'
-    db_path = os.getenv('DATABASE_URL', default_db_path)
+    db_path = database_uri
     
     if db_path.startswith('sqlite:///'):
         file_path = db_path.replace('sqlite:///', '')
@@ -99,7 +105,7 @@ def check_database():
             db.init_app(app)
             
             with app.app_context():
-                if db.engine.has_table('users') and db.engine.has_table('passwords'):
+                if {'users', 'passwords'} <= set(inspect(db.engine).get_table_names()):
                     print("✅ Database tables are properly configured")
                     return True
                 else:
@@ -3,20 +3,51 @@ Database Models for Secure Password Manager
 Defines User and Password models with appropriate security considerations.
 """
 
+from flask import g
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from datetime import datetime, timezone
+from sqlalchemy import bindparam, event, func, inspect, text
+from sqlalchemy.engine import Engine
+import base64
+import binascii
+import logging
 import secrets
+import sqlite3
 
 # Database instance - will be set by Flask-SQLAlchemy
 db = SQLAlchemy()
 
+
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Tune every new SQLite connection.
+    
+    WAL lets readers proceed while a write is in progress, synchronous=NORMAL
+    drops the per-transaction fsync that WAL makes unnecessary, and a 64 MB
+    page cache keeps hot pages in memory. Temporary tables and indices stay
+    in memory, and up to 256 MB of the file is memory-mapped so reads skip
+    the read() syscall. Foreign keys are enforced so ON DELETE CASCADE
+    applies. Other databases are left untouched.
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA cache_size=-64000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
 class User(UserMixin, db.Model):
     """
     User model for authentication and password management.
     
     Security Features:
-    - Password hashes stored using bcrypt
+    - Password hashes stored using Argon2id
     - Unique encryption key per user for password encryption
     - Session tracking for security auditing
     """
@@ -31,20 +62,16 @@ class User(UserMixin, db.Model):
     # Unique encryption key for each user's passwords
     encryption_key = db.Column(db.String(64), nullable=False, default=lambda: secrets.token_hex(32))
     
-    # Timestamps for security auditing
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    # Per-user salt for deriving the vault key once per login
+    key_salt = db.Column(db.LargeBinary(32), nullable=False, default=lambda: secrets.token_bytes(32))
+    
+    # Timestamps for security auditing (generated by the database, in UTC)
+    created_at = db.Column(db.DateTime, default=func.now(), server_default=func.now(), nullable=False)
     last_login = db.Column(db.DateTime)
     
     # Relationship to passwords (one-to-many)
-    passwords = db.relationship('Password', backref='user', lazy=True, cascade='all, delete-orphan')
-    
-    def __init__(self, username, email, password_hash):
-        """Initialize user with secure defaults"""
-        self.username = username
-        self.email = email
-        self.password_hash = password_hash
-        self.encryption_key = secrets.token_hex(32)  # Generate unique encryption key
-        self.created_at = datetime.now(timezone.utc)
+    # Rows are removed by the database's ON DELETE CASCADE, not loaded and deleted one by one
+    passwords = db.relationship('Password', backref='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
     
     def __repr__(self):
         return f'<User {self.username}>'
@@ -67,7 +94,8 @@ class Password(db.Model):
     __tablename__ = 'passwords'
     
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    # Indexed through ix_pw_user_service, whose leading column is user_id
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     
     # Service information (stored in plaintext for searchability)
     service = db.Column(db.String(100), nullable=False)
@@ -75,23 +103,17 @@ class Password(db.Model):
     url = db.Column(db.String(200))
     notes = db.Column(db.Text)
     
-    # Encrypted password (stored as base64-encoded ciphertext)
-    encrypted_password = db.Column(db.Text, nullable=False)
+    # Encrypted password (raw AES-GCM blob, see crypto_utils)
+    encrypted_password = db.Column(db.LargeBinary, nullable=False)
     
-    # Timestamps for audit trail
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
-    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    # Timestamps for audit trail (generated by the database, in UTC)
+    created_at = db.Column(db.DateTime, default=func.now(), server_default=func.now(), nullable=False)
+    updated_at = db.Column(db.DateTime, default=func.now(), server_default=func.now(), onupdate=func.now(), nullable=False)
     
-    def __init__(self, user_id, service, username, encrypted_password, url=None, notes=None):
-        """Initialize password entry with audit timestamps"""
-        self.user_id = user_id
-        self.service = service
-        self.username = username
-        self.encrypted_password = encrypted_password
-        self.url = url
-        self.notes = notes
-        self.created_at = datetime.now(timezone.utc)
-        self.updated_at = datetime.now(timezone.utc)
+    # Per-user listing and search stay within one user's index range
+    __table_args__ = (
+        db.Index('ix_pw_user_service', 'user_id', 'service'),
+    )
     
     def __repr__(self):
         return f'<Password {self.service} for {self.username}>'
@@ -106,20 +128,96 @@ def init_database(app):
     with app.app_context():
         # Create all tables
         db.create_all()
+        upgrade_schema()
         
-        # Verify tables were created
-        if not db.engine.has_table('users'):
+        # Verify tables were created (one catalog read for both)
+        tables = set(inspect(db.engine).get_table_names())
+        if 'users' not in tables:
             raise Exception("Failed to create users table")
-        if not db.engine.has_table('passwords'):
+        if 'passwords' not in tables:
             raise Exception("Failed to create passwords table")
         
         print("Database initialized successfully")
 
 
+def upgrade_schema():
+    """
+    Bring tables created by older releases up to the current schema.
+    
+    Adds users.key_salt (per-user vault key salt) and backfills a random
+    salt for every existing user, converts base64 text ciphertexts in
+    passwords.encrypted_password to raw bytes on SQLite (rows that do not
+    decode are logged and left as they are), and adds indexes introduced
+    since the table was created. Must run inside an application context.
+    """
+    columns = {column['name'] for column in inspect(db.engine).get_columns('users')}
+    
+    with db.engine.begin() as connection:
+        if 'key_salt' not in columns:
+            binary_type = db.LargeBinary().compile(dialect=connection.dialect)
+            connection.execute(text(f"ALTER TABLE users ADD COLUMN key_salt {binary_type}"))
+            user_ids = connection.execute(text("SELECT id FROM users")).scalars().all()
+            for user_id in user_ids:
+                connection.execute(
+                    text("UPDATE users SET key_salt = :salt WHERE id = :id"),
+                    {'salt': secrets.token_bytes(32), 'id': user_id}
+                )
+        
+        # Older releases only shipped SQLite, whose TEXT column takes raw bytes as-is;
+        # raw SQL so text values come back as str instead of tripping LargeBinary
+        if db.engine.dialect.name == 'sqlite':
+            rows = connection.execute(text(
+                "SELECT id, encrypted_password FROM passwords WHERE typeof(encrypted_password) = 'text'"
+            )).all()
+            for password_id, encrypted_password in rows:
+                try:
+                    data = base64.b64decode(encrypted_password, validate=True)
+                except binascii.Error:
+                    logging.warning("Skipping password ID %s: stored ciphertext is not valid base64", password_id)
+                    continue
+                connection.execute(
+                    text("UPDATE passwords SET encrypted_password = :data WHERE id = :id"),
+                    {'data': data, 'id': password_id}
+                )
+        
+        # create_all() skips indexes on tables that already exist
+        for index in Password.__table__.indexes:
+            index.create(connection, checkfirst=True)
+
+
 # Database utility functions
 def get_user_password_count(user_id):
-    """Get the number of passwords stored for a user"""
-    return Password.query.filter_by(user_id=user_id).count()
+    """Get the number of passwords stored for a user, counted at most once per request"""
+    if 'password_counts' not in g:
+        g.password_counts = {}
+    if user_id not in g.password_counts:
+        g.password_counts[user_id] = db.session.execute(
+            db.select(func.count(Password.id)).where(Password.user_id == user_id)
+        ).scalar_one()
+    return g.password_counts[user_id]
+
+
+def _passwords_cascade_on_user_delete():
+    """Whether passwords.user_id has ON DELETE CASCADE in the live schema"""
+    # Inspect through the session's connection so the check joins its transaction
+    foreign_keys = inspect(db.session.connection()).get_foreign_keys('passwords')
+    return any(
+        fk['referred_table'] == 'users' and fk['options'].get('ondelete', '').upper() == 'CASCADE'
+        for fk in foreign_keys
+    )
+
+
+def delete_user(user):
+    """
+    Delete a user and every password they have stored (the caller commits).
+    
+    The database's ON DELETE CASCADE removes the passwords. Databases created
+    before passwords.user_id gained the cascade get them removed first in
+    one bulk DELETE instead.
+    """
+    if not _passwords_cascade_on_user_delete():
+        Password.query.filter_by(user_id=user.id).delete()
+    db.session.delete(user)
 
 
 def search_passwords(user_id, search_term):
@@ -130,14 +228,29 @@ def search_passwords(user_id, search_term):
             Password.username.ilike(f'%{search_term}%'),
             Password.url.ilike(f'%{search_term}%')
         )
-    ).all()
+    ).order_by(Password.service).all()
+
+
+# Lookup statements built once; each call only binds parameters and hits the compiled cache
+_USER_BY_EMAIL = db.select(User).where(User.email == bindparam('email'))
+_USER_BY_USERNAME = db.select(User).where(User.username == bindparam('username'))
+_ACCOUNTS_MATCHING = (
+    db.select(User.username, User.email)
+    .where(db.or_(User.username == bindparam('username'), User.email == bindparam('email')))
+    .limit(2)
+)
 
 
 def get_user_by_email(email):
     """Get user by email address"""
-    return User.query.filter_by(email=email).first()
+    return db.session.execute(_USER_BY_EMAIL, {'email': email}).scalar_one_or_none()
 
 
 def get_user_by_username(username):
     """Get user by username"""
-    return User.query.filter_by(username=username).first()
+    return db.session.execute(_USER_BY_USERNAME, {'username': username}).scalar_one_or_none()
+
+
+def get_accounts_matching(username, email):
+    """Get (username, email) of users holding either value, in one indexed query"""
+    return db.session.execute(_ACCOUNTS_MATCHING, {'username': username, 'email': email}).all()
@@ -0,0 +1,93 @@
+"""
+Shared pytest fixtures for the Secure Password Manager test suite.
+The application and its schema are set up once per test session.
+"""
+
+import os
+import sys
+
+import pytest
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+# Add project root to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The app binds its engine at import, so point it at a private in-memory database first
+os.environ['DATABASE_URL'] = 'sqlite://'
+
+# Security events logged by test requests are discarded instead of written to the tree
+os.environ['SECURITY_LOG_FILE'] = os.devnull
+
+# Cheapest Argon2 time cost and no startup calibration; tests need correctness, not hardness
+os.environ.setdefault('ARGON2_TIME_COST', '1')
+
+from app import app as flask_app
+from models import db
+
+
+def pytest_addoption(parser):
+    """Add --fast for quick pre-push runs; CI runs the full suite"""
+    parser.addoption('--fast', action='store_true', help="skip tests marked 'kdf' (full-cost password hashing)")
+
+
+def pytest_configure(config):
+    """Register the kdf marker"""
+    config.addinivalue_line('markers', 'kdf: runs the production password KDF; skipped by --fast')
+
+
+def pytest_report_header(config):
+    """Say so in the header when KDF tests are being skipped"""
+    if config.getoption('--fast'):
+        return "fast mode: tests marked 'kdf' are skipped"
+
+
+def pytest_collection_modifyitems(config, items):
+    """Skip KDF-heavy tests under --fast"""
+    if not config.getoption('--fast'):
+        return
+    
+    skip_kdf = pytest.mark.skip(reason="full-cost password hashing skipped by --fast")
+    for item in items:
+        if 'kdf' in item.keywords:
+            item.add_marker(skip_kdf)
+
+
+@pytest.fixture(scope='session')
+def app():
+    """Application configured for testing, with its schema created once"""
+    flask_app.config['TESTING'] = True
+    flask_app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for testing
+    
+    with flask_app.app_context():
+        db.create_all()
+    
+    return flask_app
+
+
+@pytest.fixture(scope='class')
+def app_client(request, app):
+    """Give a unittest-style test class the app and one shared test client"""
+    request.cls.app = app
+    request.cls.client = app.test_client()
+
+
+@pytest.fixture
+def db_transaction(request):
+    """Run one test inside a transaction on its class's app, rolled back afterwards"""
+    app = request.cls.app
+    with app.app_context():
+        # pysqlite defers BEGIN until the first write, so open the transaction
+        # explicitly; session commits then only release savepoints inside it
+        connection = db.engine.connect()
+        transaction = connection.begin()
+        connection.exec_driver_sql("BEGIN")
+    
+    app_session = db.session
+    db.session = scoped_session(sessionmaker(bind=connection, join_transaction_mode='create_savepoint'))
+    
+    yield
+    
+    test_session, db.session = db.session, app_session
+    test_session.remove()
+    transaction.rollback()
+    connection.close()
@@ -4,63 +4,86 @@ Comprehensive tests for all security-critical components.
 """
 
 import unittest
-import tempfile
+import base64
 import os
-import sys
+import time
 from datetime import datetime, timezone
+from statistics import median
+from unittest import mock
+
+import bcrypt
+import pytest
+from argon2 import PasswordHasher
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from flask import Flask, g
+from sqlalchemy import event, insert, text
+
+from crypto_utils import (
+    encrypt_password, decrypt_password, generate_encryption_key, derive_master_key_once, derive_pbkdf2_key,
+    decrypt_password_batch, decrypt_legacy_password, rewrap_legacy_password, rotate_all, secure_compare,
+    ROTATE_PARALLEL_THRESHOLD
+)
+from auth import (
+    hash_password, verify_password, is_password_strong, validate_username, validate_email, validate_url,
+    clear_verification_cache, needs_rehash, calibrate_time_cost, ARGON2_MIN_TIME_COST, ARGON2_MAX_TIME_COST,
+    LOGIN_MAX_FAILURES
+)
+from models import (
+    db, User, Password, delete_user, get_user_by_username, get_user_password_count, upgrade_schema
+)
+import auth
+
+# Minimum-cost Argon2id for tests that only need some valid hash; TestAuthUtils keeps the real KDF
+fast_password_hashing = mock.patch.object(auth, '_password_hasher', PasswordHasher(time_cost=1, memory_cost=8, parallelism=1))
 
-# Add project root to path
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 class TestCryptoUtils(unittest.TestCase):
     """Test cryptographic functions"""
     
     def setUp(self):
         """Set up test fixtures"""
-        from crypto_utils import encrypt_password, decrypt_password, generate_encryption_key
-        self.encrypt_password = encrypt_password
-        self.decrypt_password = decrypt_password
-        self.generate_encryption_key = generate_encryption_key
+        self.user_salt = os.urandom(32)
+        self.derive_key = lambda master_key: derive_master_key_once(master_key, self.user_salt)
     
     def test_password_encryption_decryption(self):
         """Test basic encryption and decryption"""
         password = "test_password_123!"
-        master_key = "master_key_for_testing"
+        master_key = self.derive_key("master_key_for_testing")
         
         # Encrypt password
-        encrypted = self.encrypt_password(password, master_key)
-        self.assertIsInstance(encrypted, str)
-        self.assertNotEqual(encrypted, password)
+        encrypted = encrypt_password(password, master_key)
+        self.assertIsInstance(encrypted, bytes)
+        self.assertNotEqual(encrypted, password.encode('utf-8'))
         
         # Decrypt password
-        decrypted = self.decrypt_password(encrypted, master_key)
+        decrypted = decrypt_password(encrypted, master_key)
         self.assertEqual(decrypted, password)
     
     def test_encryption_with_different_keys(self):
         """Test that different keys produce different ciphertexts"""
         password = "same_password"
-        key1 = "key_one"
-        key2 = "key_two"
+        key1 = self.derive_key("key_one")
+        key2 = self.derive_key("key_two")
         
-        encrypted1 = self.encrypt_password(password, key1)
-        encrypted2 = self.encrypt_password(password, key2)
+        encrypted1 = encrypt_password(password, key1)
+        encrypted2 = encrypt_password(password, key2)
         
         self.assertNotEqual(encrypted1, encrypted2)
     
     def test_encryption_randomness(self):
         """Test that encryption produces different outputs for same input"""
         password = "same_password"
-        master_key = "same_key"
+        master_key = self.derive_key("same_key")
         
-        encrypted1 = self.encrypt_password(password, master_key)
-        encrypted2 = self.encrypt_password(password, master_key)
+        encrypted1 = encrypt_password(password, master_key)
+        encrypted2 = encrypt_password(password, master_key)
         
         # Should be different due to random IV
         self.assertNotEqual(encrypted1, encrypted2)
         
         # But both should decrypt to same password
-        decrypted1 = self.decrypt_password(encrypted1, master_key)
-        decrypted2 = self.decrypt_password(encrypted2, master_key)
+        decrypted1 = decrypt_password(encrypted1, master_key)
+        decrypted2 = decrypt_password(encrypted2, master_key)
         
         self.assertEqual(decrypted1, password)
         self.assertEqual(decrypted2, password)
@@ -68,256 +91,523 @@ class TestCryptoUtils(unittest.TestCase):
     def test_wrong_key_decryption(self):
         """Test that wrong key fails decryption"""
         password = "test_password"
-        correct_key = "correct_key"
-        wrong_key = "wrong_key"
+        correct_key = self.derive_key("correct_key")
+        wrong_key = self.derive_key("wrong_key")
         
-        encrypted = self.encrypt_password(password, correct_key)
+        encrypted = encrypt_password(password, correct_key)
         
         with self.assertRaises(Exception):
-            self.decrypt_password(encrypted, wrong_key)
+            decrypt_password(encrypted, wrong_key)
     
     def test_empty_password_encryption(self):
         """Test encryption with empty password"""
         with self.assertRaises(ValueError):
-            self.encrypt_password("", "some_key")
+            encrypt_password("", self.derive_key("some_key"))
     
     def test_empty_key_encryption(self):
         """Test encryption with empty key"""
         with self.assertRaises(ValueError):
-            self.encrypt_password("password", "")
+            encrypt_password("password", b"")
+    
+    def test_decrypt_password_batch(self):
+        """Test batch decryption keeps order and skips corrupted entries"""
+        master_key = self.derive_key("batch_master_key")
+        encrypted = [encrypt_password(p, master_key) for p in ("first_pw", "second_pw")]
+        
+        results = list(decrypt_password_batch(encrypted + [b"corrupted"], master_key))
+        self.assertEqual(results, ["first_pw", "second_pw", None])
+        
+        with self.assertRaises(ValueError):
+            decrypt_password_batch(encrypted, b"")
+    
+    def test_legacy_blob_rewrap(self):
+        """Test that per-entry-salt blobs still decrypt and are rewrapped under the vault key"""
+        master_key = "legacy_master_key"
+        vault_key = self.derive_key(master_key)
+        
+        # Build a blob in the pre-vault-key layout: salt + iv + tag + ciphertext
+        salt, iv = os.urandom(32), os.urandom(16)
+        encryptor = Cipher(algorithms.AES(derive_pbkdf2_key(master_key, salt)), modes.GCM(iv)).encryptor()
+        ciphertext = encryptor.update(b"legacy_pw") + encryptor.finalize()
+        legacy = salt + iv + encryptor.tag + ciphertext
+        
+        # And one under a PBKDF2-derived vault key: format byte + iv + tag + ciphertext
+        encryptor = Cipher(algorithms.AES(derive_pbkdf2_key(master_key, self.user_salt)), modes.GCM(iv)).encryptor()
+        ciphertext = encryptor.update(b"pbkdf2_pw") + encryptor.finalize()
+        pbkdf2_blob = b"\x01" + iv + encryptor.tag + ciphertext
+        
+        results = decrypt_password_batch([legacy, pbkdf2_blob], vault_key, master_key, self.user_salt)
+        self.assertEqual(list(results), ["legacy_pw", "pbkdf2_pw"])
+        
+        rewrapped = rewrap_legacy_password(legacy, master_key, self.user_salt, vault_key)
+        self.assertEqual(decrypt_password(rewrapped, vault_key), "legacy_pw")
+        self.assertIsNone(rewrap_legacy_password(rewrapped, master_key, self.user_salt, vault_key))
+        
+        rewrapped = rewrap_legacy_password(pbkdf2_blob, master_key, self.user_salt, vault_key)
+        self.assertEqual(decrypt_password(rewrapped, vault_key), "pbkdf2_pw")
+        
+        # Argon2id vault key with a 16-byte IV is still read directly, then moved to 12-byte IVs
+        encryptor = Cipher(algorithms.AES(vault_key), modes.GCM(iv)).encryptor()
+        ciphertext = encryptor.update(b"iv16_pw") + encryptor.finalize()
+        iv16_blob = b"\x02" + iv + encryptor.tag + ciphertext
+        self.assertEqual(decrypt_password(iv16_blob, vault_key), "iv16_pw")
+        
+        rewrapped = rewrap_legacy_password(iv16_blob, master_key, self.user_salt, vault_key)
+        self.assertEqual(len(rewrapped), 1 + 12 + 16 + len(b"iv16_pw"))
+        self.assertEqual(decrypt_password(rewrapped, vault_key), "iv16_pw")
+    
+    def test_legacy_key_passed_down(self):
+        """Test that a legacy key supplied by the caller is used instead of re-derived"""
+        master_key = "legacy_master_key"
+        vault_key = self.derive_key(master_key)
+        legacy_key = derive_pbkdf2_key(master_key, self.user_salt)
+        
+        iv = os.urandom(16)
+        encryptor = Cipher(algorithms.AES(legacy_key), modes.GCM(iv)).encryptor()
+        ciphertext = encryptor.update(b"pbkdf2_pw") + encryptor.finalize()
+        pbkdf2_blob = b"\x01" + iv + encryptor.tag + ciphertext
+        
+        with mock.patch('crypto_utils.derive_pbkdf2_key') as derive:
+            self.assertEqual(decrypt_legacy_password(pbkdf2_blob, master_key, self.user_salt, legacy_key), "pbkdf2_pw")
+            rewrapped = rewrap_legacy_password(pbkdf2_blob, master_key, self.user_salt, vault_key, legacy_key)
+        
+        derive.assert_not_called()
+        self.assertEqual(decrypt_password(rewrapped, vault_key), "pbkdf2_pw")
+    
+    def test_rotate_all(self):
+        """Test vault rotation re-encrypts every entry in order, serially and in parallel"""
+        old_key = self.derive_key("old_master_key")
+        new_key = self.derive_key("new_master_key")
+        
+        for count in (3, ROTATE_PARALLEL_THRESHOLD):
+            plaintexts = ["pw_%d" % i for i in range(count)]
+            rotated = rotate_all([encrypt_password(p, old_key) for p in plaintexts], old_key, new_key)
+            self.assertEqual([decrypt_password(entry, new_key) for entry in rotated], plaintexts)
     
     def test_generate_encryption_key(self):
         """Test encryption key generation"""
-        key = self.generate_encryption_key()
+        key = generate_encryption_key()
         
         self.assertIsInstance(key, str)
         self.assertEqual(len(key), 64)  # 32 bytes * 2 for hex
         
         # Generate another key and ensure they're different
-        key2 = self.generate_encryption_key()
+        key2 = generate_encryption_key()
         self.assertNotEqual(key, key2)
 
 
 class TestAuthUtils(unittest.TestCase):
     """Test authentication functions"""
     
-    def setUp(self):
-        """Set up test fixtures"""
-        from auth import hash_password, verify_password, is_password_strong, validate_username, validate_email
-        self.hash_password = hash_password
-        self.verify_password = verify_password
-        self.is_password_strong = is_password_strong
-        self.validate_username = validate_username
-        self.validate_email = validate_email
-    
+    @pytest.mark.kdf
     def test_password_hashing_verification(self):
         """Test password hashing and verification"""
         password = "test_password_123!"
         
         # Hash password
-        hashed = self.hash_password(password)
+        hashed = hash_password(password)
         self.assertIsInstance(hashed, str)
         self.assertNotEqual(hashed, password)
         
         # Verify correct password
-        self.assertTrue(self.verify_password(password, hashed))
+        self.assertTrue(verify_password(password, hashed))
         
         # Verify wrong password
-        self.assertFalse(self.verify_password("wrong_password", hashed))
+        self.assertFalse(verify_password("wrong_password", hashed))
     
+    @pytest.mark.kdf
     def test_password_hash_uniqueness(self):
         """Test that same password produces different hashes"""
         password = "same_password"
         
-        hash1 = self.hash_password(password)
-        hash2 = self.hash_password(password)
+        hash1 = hash_password(password)
+        hash2 = hash_password(password)
         
         # Hashes should be different due to salt
         self.assertNotEqual(hash1, hash2)
         
         # But both should verify correctly
-        self.assertTrue(self.verify_password(password, hash1))
-        self.assertTrue(self.verify_password(password, hash2))
+        self.assertTrue(verify_password(password, hash1))
+        self.assertTrue(verify_password(password, hash2))
+    
+    @pytest.mark.kdf
+    def test_verification_cache(self):
+        """Test that cached verifications never accept a wrong password"""
+        password = "cached_password_123!"
+        hashed = hash_password(password)
+        
+        # First verification populates the cache, second is served from it
+        self.assertTrue(verify_password(password, hashed))
+        self.assertTrue(verify_password(password, hashed))
+        
+        # Wrong password must still fail while the correct one is cached
+        self.assertFalse(verify_password("wrong_password", hashed))
+        
+        clear_verification_cache()
+        self.assertTrue(verify_password(password, hashed))
+    
+    def test_legacy_bcrypt_hash_verification(self):
+        """Test that legacy bcrypt hashes verify and are flagged for rehash"""
+        password = "legacy_password_123!"
+        legacy_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=4)).decode('utf-8')
+        
+        self.assertTrue(verify_password(password, legacy_hash))
+        self.assertFalse(verify_password("wrong_password", legacy_hash))
+        self.assertTrue(needs_rehash(legacy_hash))
+        self.assertFalse(needs_rehash(hash_password(password)))
+    
+    def test_time_cost_calibration_bounds(self):
+        """Test that calibration never leaves the allowed time cost range"""
+        self.assertEqual(calibrate_time_cost(0), ARGON2_MIN_TIME_COST)
+        self.assertEqual(calibrate_time_cost(1000), ARGON2_MAX_TIME_COST)
     
     def test_empty_password_hashing(self):
         """Test hashing empty password"""
         with self.assertRaises(ValueError):
-            self.hash_password("")
+            hash_password("")
     
     def test_short_password_hashing(self):
         """Test hashing password that's too short"""
         with self.assertRaises(ValueError):
-            self.hash_password("short")
+            hash_password("short")
     
     def test_password_strength_validation(self):
         """Test password strength checking"""
         # Strong password
         strong_pass = "MyStr0ng!P@ssw0rd"
-        is_strong, issues = self.is_password_strong(strong_pass)
+        is_strong, issues = is_password_strong(strong_pass)
         self.assertTrue(is_strong)
         self.assertEqual(len(issues), 0)
         
         # Weak password
         weak_pass = "password"
-        is_strong, issues = self.is_password_strong(weak_pass)
+        is_strong, issues = is_password_strong(weak_pass)
         self.assertFalse(is_strong)
         self.assertGreater(len(issues), 0)
         
         # Common password
         common_pass = "password123"
-        is_strong, issues = self.is_password_strong(common_pass)
+        is_strong, issues = is_password_strong(common_pass)
         self.assertFalse(is_strong)
         self.assertIn("Password is too common", issues)
     
     def test_username_validation(self):
         """Test username validation"""
         # Valid username
-        valid, issues = self.validate_username("valid_user123")
+        valid, issues = validate_username("valid_user123")
         self.assertTrue(valid)
         self.assertEqual(len(issues), 0)
         
         # Invalid username - too short
-        valid, issues = self.validate_username("ab")
+        valid, issues = validate_username("ab")
         self.assertFalse(valid)
         self.assertGreater(len(issues), 0)
         
         # Invalid username - starts with number
-        valid, issues = self.validate_username("123user")
+        valid, issues = validate_username("123user")
         self.assertFalse(valid)
         self.assertGreater(len(issues), 0)
+        
+        # Invalid username - disallowed characters
+        for username in ("bad-name", "user name", "üser"):
+            valid, issues = validate_username(username)
+            self.assertFalse(valid)
+            self.assertIn("Username can only contain letters, numbers, and underscores", issues)
     
     def test_email_validation(self):
         """Test email validation"""
         # Valid email
-        valid, issues = self.validate_email("user@example.com")
+        valid, issues = validate_email("user@example.com")
         self.assertTrue(valid)
         self.assertEqual(len(issues), 0)
         
         # Invalid email
-        valid, issues = self.validate_email("invalid_email")
+        valid, issues = validate_email("invalid_email")
         self.assertFalse(valid)
         self.assertGreater(len(issues), 0)
+    
+    def test_url_validation(self):
+        """Test URL validation accepts web URLs and rejects malformed ones quickly"""
+        for url in ("https://example.com", "http://mail.example.co.uk:8080/login?next=/",
+                    "http://localhost:5000", "http://192.168.1.1/admin"):
+            self.assertTrue(validate_url(url)[0], url)
+        
+        for url in ("ftp://example.com", "https://", "https://exa mple.com", "https://user@example.com",
+                    "https://example", "https://example.com:99999", "example.com"):
+            self.assertFalse(validate_url(url)[0], url)
+        
+        # Input shaped to make a backtracking regex blow up
+        start = time.perf_counter()
+        self.assertFalse(validate_url("http://" + "a" * 60 + "." + "a-" * 70 + "!")[0])
+        self.assertLess(time.perf_counter() - start, 0.1)
 
 
+@fast_password_hashing
+@pytest.mark.usefixtures('db_transaction')
 class TestModels(unittest.TestCase):
     """Test database models"""
     
-    def setUp(self):
-        """Set up test database"""
-        from flask import Flask
-        from models import db, User, Password
-        
-        self.app = Flask(__name__)
-        self.app.config['TESTING'] = True
-        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
-        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-        
-        db.init_app(self.app)
-        
-        with self.app.app_context():
-            db.create_all()
-        
-        self.app_context = self.app.app_context()
-        self.app_context.push()
-        
-        self.User = User
-        self.Password = Password
-        self.db = db
+    @classmethod
+    def setUpClass(cls):
+        """Create the test database schema once for the whole class"""
+        cls.app = Flask(__name__)
+        cls.app.config['TESTING'] = True
+        cls.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        cls.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        
+        db.init_app(cls.app)
+        
+        # One application context for the whole class; tests only swap the session
+        cls.app_context = cls.app.app_context()
+        cls.app_context.push()
+        db.create_all()
+        
+        # Hashing and key derivation are the slow parts of these fixtures; do them once
+        with fast_password_hashing:
+            cls.sample_hash = hash_password("testpassword123!")
+        cls.sample_encryption_key = generate_encryption_key()
+        cls.sample_key_salt = os.urandom(32)
+        cls.sample_vault_key = derive_master_key_once(cls.sample_encryption_key, cls.sample_key_salt)
+        cls.sample_encrypted = encrypt_password("gmail_password_123!", cls.sample_vault_key)
+    
+    @classmethod
+    def tearDownClass(cls):
+        """Release the class application context"""
+        cls.app_context.pop()
     
-    def tearDown(self):
-        """Clean up test database"""
-        self.db.session.remove()
-        self.db.drop_all()
-        self.app_context.pop()
+    def setUp(self):
+        """Drop per-request values such as memoized counts; the context outlives each test"""
+        vars(g).clear()
     
     def test_user_creation(self):
         """Test user model creation"""
-        from auth import hash_password
-        
         username = "testuser"
         email = "test@example.com"
-        password_hash = hash_password("testpassword123!")
-        
-        user = self.User(username=username, email=email, password_hash=password_hash)
-        self.db.session.add(user)
-        self.db.session.commit()
+        user = User(username=username, email=email, password_hash=self.sample_hash)
+        db.session.add(user)
+        db.session.commit()
         
         # Verify user was created
-        retrieved_user = self.User.query.filter_by(username=username).first()
+        retrieved_user = User.query.filter_by(username=username).first()
         self.assertIsNotNone(retrieved_user)
         self.assertEqual(retrieved_user.username, username)
         self.assertEqual(retrieved_user.email, email)
         self.assertIsNotNone(retrieved_user.encryption_key)
         self.assertEqual(len(retrieved_user.encryption_key), 64)  # 32 bytes hex
+        self.assertEqual(len(retrieved_user.key_salt), 32)
+        self.assertIsNotNone(retrieved_user.created_at)
     
     def test_password_entry_creation(self):
         """Test password entry model creation"""
-        from auth import hash_password
-        from crypto_utils import encrypt_password
-        
         # Create user first
-        user = self.User(
+        user = User(
             username="testuser",
             email="test@example.com",
-            password_hash=hash_password("testpassword123!")
+            password_hash=self.sample_hash,
+            encryption_key=self.sample_encryption_key,
+            key_salt=self.sample_key_salt
         )
-        self.db.session.add(user)
-        self.db.session.commit()
+        db.session.add(user)
+        db.session.commit()
         
         # Create password entry
         service = "Gmail"
         username = "test@gmail.com"
         plain_password = "gmail_password_123!"
-        encrypted_password = encrypt_password(plain_password, user.encryption_key)
         
-        password_entry = self.Password(
+        password_entry = Password(
             user_id=user.id,
             service=service,
             username=username,
-            encrypted_password=encrypted_password,
+            encrypted_password=self.sample_encrypted,
             url="https://gmail.com",
             notes="Personal email account"
         )
-        self.db.session.add(password_entry)
-        self.db.session.commit()
+        db.session.add(password_entry)
+        db.session.commit()
         
         # Verify password entry
-        retrieved_entry = self.Password.query.filter_by(service=service).first()
+        retrieved_entry = Password.query.filter_by(service=service).first()
         self.assertIsNotNone(retrieved_entry)
         self.assertEqual(retrieved_entry.service, service)
         self.assertEqual(retrieved_entry.username, username)
         self.assertEqual(retrieved_entry.user_id, user.id)
         
         # Verify password can be decrypted
-        from crypto_utils import decrypt_password
-        decrypted = decrypt_password(retrieved_entry.encrypted_password, user.encryption_key)
+        decrypted = decrypt_password(retrieved_entry.encrypted_password, self.sample_vault_key)
         self.assertEqual(decrypted, plain_password)
+    
+    def test_user_deletion_cascades_to_passwords(self):
+        """Test that deleting a user removes their stored passwords in the database"""
+        user = User(
+            username="testuser",
+            email="test@example.com",
+            password_hash=self.sample_hash
+        )
+        db.session.add(user)
+        db.session.commit()
+        
+        db.session.add(Password(
+            user_id=user.id,
+            service="Gmail",
+            username="test@gmail.com",
+            encrypted_password=self.sample_encrypted
+        ))
+        db.session.commit()
+        
+        db.session.delete(user)
+        db.session.commit()
+        
+        self.assertEqual(Password.query.count(), 0)
+    
+    def test_delete_user_relies_on_cascade(self):
+        """Test that delete_user leaves the passwords to ON DELETE CASCADE on the current schema"""
+        user = User(username="testuser", email="test@example.com", password_hash=self.sample_hash)
+        db.session.add(user)
+        db.session.commit()
+        db.session.add(Password(user_id=user.id, service="Gmail", username="test@gmail.com",
+                                encrypted_password=self.sample_encrypted))
+        db.session.commit()
+        
+        statements = []
+        
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+        
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            delete_user(user)
+            db.session.commit()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        
+        self.assertEqual([sql for sql in statements if sql.startswith('DELETE')], ['DELETE FROM users WHERE users.id = ?'])
+        self.assertEqual(Password.query.count(), 0)
+    
+    def test_get_user_password_count(self):
+        """Test password count is computed in SQL and memoized for the request"""
+        user = User(
+            username="testuser",
+            email="test@example.com",
+            password_hash=self.sample_hash
+        )
+        db.session.add(user)
+        db.session.commit()
+        
+        # Column defaults fill the rest, so plain mappings can be inserted in one executemany
+        db.session.execute(insert(Password), [
+            {'user_id': user.id, 'service': service, 'username': "test", 'encrypted_password': b"blob"}
+            for service in ("Gmail", "GitHub")
+        ])
+        db.session.commit()
+        
+        self.assertEqual(get_user_password_count(user.id), 2)
+        self.assertEqual(g.password_counts, {user.id: 2})
 
 
-class TestApplicationRoutes(unittest.TestCase):
-    """Test Flask application routes"""
+@fast_password_hashing
+class TestSchemaUpgrade(unittest.TestCase):
+    """Test upgrades of databases created by older releases"""
     
     def setUp(self):
-        """Set up test application"""
-        import tempfile
-        self.db_fd, self.db_path = tempfile.mkstemp()
-        
-        # Import app after setting up database
-        from app import app, db
-        app.config['TESTING'] = True
-        app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{self.db_path}'
-        app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for testing
+        """Set up a fresh test database (upgrades commit, so no shared rollback)"""
+        self.app = Flask(__name__)
+        self.app.config['TESTING'] = True
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
         
-        self.app = app
-        self.client = app.test_client()
+        db.init_app(self.app)
         
-        with app.app_context():
-            db.create_all()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
     
     def tearDown(self):
-        """Clean up test application"""
-        os.close(self.db_fd)
-        os.unlink(self.db_path)
+        """Clean up test database"""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+    
+    def test_upgrade_schema_converts_base64_ciphertexts(self):
+        """Test that text ciphertexts from older releases are stored back as raw bytes"""
+        user = User(
+            username="testuser",
+            email="test@example.com",
+            password_hash=hash_password("testpassword123!")
+        )
+        db.session.add(user)
+        db.session.commit()
+        
+        blob = os.urandom(48)
+        db.session.execute(
+            text("INSERT INTO passwords (user_id, service, username, encrypted_password, created_at, updated_at) "
+                 "VALUES (:user_id, 'Gmail', 'test@gmail.com', :data, :now, :now)"),
+            {'user_id': user.id, 'data': base64.b64encode(blob).decode('utf-8'), 'now': datetime.now(timezone.utc)}
+        )
+        db.session.commit()
+        
+        upgrade_schema()
+        
+        self.assertEqual(Password.query.one().encrypted_password, blob)
+    
+    def test_upgrade_schema_skips_malformed_base64(self):
+        """Test that a text ciphertext which is not valid base64 is left alone instead of aborting"""
+        user = User(username="testuser", email="test@example.com", password_hash=hash_password("testpassword123!"))
+        db.session.add(user)
+        db.session.commit()
+        
+        blob = os.urandom(48)
+        for service, data in (("Broken", "abc"), ("Gmail", base64.b64encode(blob).decode('utf-8'))):
+            db.session.execute(
+                text("INSERT INTO passwords (user_id, service, username, encrypted_password, created_at, updated_at) "
+                     "VALUES (:user_id, :service, 'test@gmail.com', :data, :now, :now)"),
+                {'user_id': user.id, 'service': service, 'data': data, 'now': datetime.now(timezone.utc)}
+            )
+        db.session.commit()
+        
+        upgrade_schema()
+        
+        stored = dict(db.session.execute(db.select(Password.service, Password.encrypted_password)).all())
+        self.assertEqual(stored, {"Broken": "abc", "Gmail": blob})
+    
+    def test_delete_user_on_legacy_schema(self):
+        """Test account deletion where passwords.user_id has no ON DELETE CASCADE"""
+        db.drop_all()
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql(
+                "CREATE TABLE users (id INTEGER NOT NULL PRIMARY KEY, username VARCHAR(80) NOT NULL UNIQUE, "
+                "email VARCHAR(120) NOT NULL UNIQUE, password_hash VARCHAR(128) NOT NULL, "
+                "encryption_key VARCHAR(64) NOT NULL, created_at DATETIME NOT NULL, last_login DATETIME)"
+            )
+            connection.exec_driver_sql(
+                "CREATE TABLE passwords (id INTEGER NOT NULL PRIMARY KEY, "
+                "user_id INTEGER NOT NULL REFERENCES users (id), service VARCHAR(100) NOT NULL, "
+                "username VARCHAR(100) NOT NULL, url VARCHAR(200), notes TEXT, encrypted_password TEXT NOT NULL, "
+                "created_at DATETIME NOT NULL, updated_at DATETIME NOT NULL)"
+            )
+        upgrade_schema()
+        
+        user = User(username="testuser", email="test@example.com", password_hash=hash_password("testpassword123!"))
+        db.session.add(user)
+        db.session.commit()
+        db.session.add(Password(user_id=user.id, service="Gmail", username="test@gmail.com", encrypted_password=b"x"))
+        db.session.commit()
+        
+        delete_user(user)
+        db.session.commit()
+        
+        self.assertEqual(User.query.count(), 0)
+        self.assertEqual(Password.query.count(), 0)
+
+
+@fast_password_hashing
+@pytest.mark.usefixtures('app_client', 'db_transaction')
+class TestApplicationRoutes(unittest.TestCase):
+    """Test Flask application routes"""
+    
+    def setUp(self):
+        """Start each test logged out on the shared client"""
+        self.client.delete_cookie(self.app.config['SESSION_COOKIE_NAME'])
     
     def test_index_route(self):
         """Test home page route"""
@@ -337,6 +627,31 @@ class TestApplicationRoutes(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         # Should redirect to login page after successful registration
     
+    def test_register_rejects_taken_username_and_email(self):
+        """Test that registration refuses an existing username or email"""
+        self.client.post('/register', data={
+            'username': 'takenuser',
+            'email': 'taken@example.com',
+            'password': 'TestPassword123!',
+            'confirm_password': 'TestPassword123!'
+        })
+        
+        response = self.client.post('/register', data={
+            'username': 'takenuser',
+            'email': 'fresh@example.com',
+            'password': 'TestPassword123!',
+            'confirm_password': 'TestPassword123!'
+        })
+        self.assertIn(b'Username already exists', response.data)
+        
+        response = self.client.post('/register', data={
+            'username': 'freshuser',
+            'email': 'taken@example.com',
+            'password': 'TestPassword123!',
+            'confirm_password': 'TestPassword123!'
+        })
+        self.assertIn(b'Email already registered', response.data)
+    
     def test_login_route(self):
         """Test user login"""
         # First register a user
@@ -354,6 +669,168 @@ class TestApplicationRoutes(unittest.TestCase):
         }, follow_redirects=True)
         
         self.assertEqual(response.status_code, 200)
+        
+        # Successful login records the login time
+        with self.app.app_context():
+            self.assertIsNotNone(get_user_by_username('testuser').last_login)
+    
+    def test_dashboard_shows_decrypted_passwords(self):
+        """Test that stored passwords are decrypted on the dashboard"""
+        self.client.post('/register', data={
+            'username': 'testuser',
+            'email': 'test@example.com',
+            'password': 'TestPassword123!',
+            'confirm_password': 'TestPassword123!'
+        })
+        self.client.post('/login', data={
+            'username': 'testuser',
+            'password': 'TestPassword123!'
+        })
+        self.client.post('/add_password', data={
+            'service': 'Gmail',
+            'username': 'test@gmail.com',
+            'password': 'gmail_secret_123!'
+        })
+        
+        response = self.client.get('/dashboard')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Gmail', response.data)
+        self.assertIn(b'gmail_secret_123!', response.data)
+    
+    def test_flashed_messages_shown_once(self):
+        """Test that a flash rendered on the dashboard is cleared from the session"""
+        self.client.post('/register', data={
+            'username': 'flashuser',
+            'email': 'flash@example.com',
+            'password': 'TestPassword123!',
+            'confirm_password': 'TestPassword123!'
+        })
+        self.client.post('/login', data={
+            'username': 'flashuser',
+            'password': 'TestPassword123!'
+        })
+        
+        self.assertIn(b'Welcome back, flashuser!', self.client.get('/dashboard').data)
+        self.assertNotIn(b'Welcome back, flashuser!', self.client.get('/settings').data)
+    
+    def test_dashboard_skips_undecryptable_entries(self):
+        """Test that corrupted entries are neither listed nor counted"""
+        self.client.post('/register', data={
+            'username': 'corrupteduser',
+            'email': 'corrupted@example.com',
+            'password': 'TestPassword123!',
+            'confirm_password': 'TestPassword123!'
+        })
+        self.client.post('/login', data={
+            'username': 'corrupteduser',
+            'password': 'TestPassword123!'
+        })
+        with self.app.app_context():
+            user = get_user_by_username('corrupteduser')
+            db.session.add(Password(user_id=user.id, service="Broken", username="x", encrypted_password=b"corrupted"))
+            db.session.commit()
+        
+        response = self.client.get('/dashboard')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(b'Broken', response.data)
+        self.assertIn(b'Your password vault is empty', response.data)
+    
+    def test_dashboard_derives_legacy_key_once(self):
+        """Test that entries not yet rewrapped share one legacy key derivation per request"""
+        self.client.post('/register', data={
+            'username': 'legacyuser',
+            'email': 'legacy@example.com',
+            'password': 'TestPassword123!',
+            'confirm_password': 'TestPassword123!'
+        })
+        self.client.post('/login', data={
+            'username': 'legacyuser',
+            'password': 'TestPassword123!'
+        })
+        with self.app.app_context():
+            user = get_user_by_username('legacyuser')
+            legacy_key = derive_pbkdf2_key(user.encryption_key, user.key_salt)
+            for service in ("LegacyOne", "LegacyTwo"):
+                iv = os.urandom(16)
+                encryptor = Cipher(algorithms.AES(legacy_key), modes.GCM(iv)).encryptor()
+                ciphertext = encryptor.update(b"legacy_pw") + encryptor.finalize()
+                db.session.add(Password(user_id=user.id, service=service, username="x",
+                                        encrypted_password=b"\x01" + iv + encryptor.tag + ciphertext))
+            db.session.commit()
+        
+        with mock.patch('app.derive_pbkdf2_key', wraps=derive_pbkdf2_key) as derive:
+            response = self.client.get('/dashboard')
+        
+        self.assertEqual(derive.call_count, 1)
+        self.assertIn(b'LegacyOne', response.data)
+        self.assertIn(b'LegacyTwo', response.data)
+        
+        # Logging in again rewraps both entries with a single derivation too
+        self.client.get('/logout')
+        with mock.patch('app.derive_pbkdf2_key', wraps=derive_pbkdf2_key) as derive:
+            self.client.post('/login', data={
+                'username': 'legacyuser',
+                'password': 'TestPassword123!'
+            })
+        
+        self.assertEqual(derive.call_count, 1)
+        with self.app.app_context():
+            user = get_user_by_username('legacyuser')
+            vault_key = derive_master_key_once(user.encryption_key, user.key_salt)
+            stored = [p.encrypted_password for p in Password.query.filter_by(user_id=user.id)]
+        self.assertEqual([decrypt_password(blob, vault_key) for blob in stored], ["legacy_pw", "legacy_pw"])
+    
+    def test_login_throttled_after_repeated_failures(self):
+        """Test that repeated failures lock out even the correct password"""
+        self.client.post('/register', data={
+            'username': 'throttleduser',
+            'email': 'throttled@example.com',
+            'password': 'TestPassword123!',
+            'confirm_password': 'TestPassword123!'
+        })
+        
+        for _ in range(LOGIN_MAX_FAILURES):
+            self.client.post('/login', data={
+                'username': 'throttleduser',
+                'password': 'WrongPassword123!'
+            })
+        
+        response = self.client.post('/login', data={
+            'username': 'throttleduser',
+            'password': 'TestPassword123!'
+        })
+        
+        # Throttled logins re-render the form instead of redirecting
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Too many failed login attempts', response.data)
+    
+    def test_delete_account(self):
+        """Test that deleting an account removes the user and their stored passwords"""
+        self.client.post('/register', data={
+            'username': 'deleteduser',
+            'email': 'deleted@example.com',
+            'password': 'TestPassword123!',
+            'confirm_password': 'TestPassword123!'
+        })
+        self.client.post('/login', data={
+            'username': 'deleteduser',
+            'password': 'TestPassword123!'
+        })
+        self.client.post('/add_password', data={
+            'service': 'Gmail',
+            'username': 'deleted@gmail.com',
+            'password': 'gmail_secret_123!'
+        })
+        
+        response = self.client.post('/settings', data={
+            'action': 'delete_account',
+            'delete_confirm_password': 'TestPassword123!'
+        }, follow_redirects=True)
+        
+        self.assertIn(b'Your account has been permanently deleted', response.data)
+        with self.app.app_context():
+            self.assertIsNone(get_user_by_username('deleteduser'))
+            self.assertEqual(Password.query.filter_by(username='deleted@gmail.com').count(), 0)
     
     def test_protected_routes_redirect(self):
         """Test that protected routes redirect to login"""
@@ -364,37 +841,19 @@ class TestApplicationRoutes(unittest.TestCase):
             self.assertEqual(response.status_code, 302)  # Redirect to login
 
 
+@fast_password_hashing
+@pytest.mark.usefixtures('app_client', 'db_transaction')
 class TestSecurity(unittest.TestCase):
     """Test security measures"""
     
     def setUp(self):
-        """Set up test application"""
-        import tempfile
-        self.db_fd, self.db_path = tempfile.mkstemp()
-        
-        # Import app after setting up database
-        from app import app, db
-        app.config['TESTING'] = True
-        app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{self.db_path}'
-        app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for testing
-        
-        self.app = app
-        self.client = app.test_client()
-        
-        with app.app_context():
-            db.create_all()
-    
-    def tearDown(self):
-        """Clean up test application"""
-        os.close(self.db_fd)
-        os.unlink(self.db_path)
+        """Start each test logged out on the shared client"""
+        self.client.delete_cookie(self.app.config['SESSION_COOKIE_NAME'])
     
     def test_sql_injection_protection(self):
         """Test protection against SQL injection"""
         # This would be more comprehensive in a real security audit
         with self.app.app_context():
-            from models import get_user_by_username
-            
             # Try SQL injection in username
             malicious_username = "'; DROP TABLE users; --"
             user = get_user_by_username(malicious_username)
@@ -402,77 +861,33 @@ class TestSecurity(unittest.TestCase):
     
     def test_password_timing_attack_protection(self):
         """Test constant-time password comparison"""
-        from crypto_utils import secure_compare
-        
-        import time
-        
-        # Test equal strings
-        start = time.time()
-        result1 = secure_compare("password123", "password123")
-        end_time1 = time.time() - start
-        
-        # Test different strings
-        start = time.time()
-        result2 = secure_compare("password123", "different123")
-        end_time2 = time.time() - start
-        
-        self.assertTrue(result1)
-        self.assertFalse(result2)
+        self.assertTrue(secure_compare("password123", "password123"))
+        self.assertFalse(secure_compare("password123", "different123"))
+        self.assertTrue(secure_compare("pässwörd", "pässwörd"))
+        self.assertTrue(secure_compare(b"token", b"token"))
+        
+        # Equal-length inputs, so a length check cannot short-circuit; the mismatch
+        # is in the first byte, where an early-exit comparison would be fastest
+        secret = "a" * 64
+        equal, different = "a" * 64, "b" + "a" * 63
+        
+        # Interleave many samples so scheduler jitter and drift hit both sides alike
+        equal_times, different_times = [], []
+        for _ in range(1000):
+            start = time.perf_counter_ns()
+            secure_compare(secret, equal)
+            equal_times.append(time.perf_counter_ns() - start)
+            
+            start = time.perf_counter_ns()
+            secure_compare(secret, different)
+            different_times.append(time.perf_counter_ns() - start)
+        
+        equal_median, different_median = median(equal_times), median(different_times)
+        spread = max(
+            median(abs(t - equal_median) for t in equal_times),
+            median(abs(t - different_median) for t in different_times),
+            time.get_clock_info('perf_counter').resolution * 1e9
+        )
         
-        # Time difference should be minimal (constant time)
-        time_diff = abs(end_time1 - end_time2)
-        self.assertLess(time_diff, 0.01)  # Should be less than 10ms difference
-        # Note: This is a basic test; real timing attack tests require more sophisticated analysis
-
-
-def run_tests():
-    """Run all tests"""
-    print("🧪 Running Secure Password Manager Test Suite")
-    print("=" * 50)
-    
-    # Create test suite
-    test_modules = [
-        TestCryptoUtils,
-        TestAuthUtils,
-        TestModels,
-        TestApplicationRoutes,
-        TestSecurity
-    ]
-    
-    suite = unittest.TestSuite()
-    
-    for test_module in test_modules:
-        tests = unittest.TestLoader().loadTestsFromTestCase(test_module)
-        suite.addTests(tests)
-    
-    # Run tests
-    runner = unittest.TextTestRunner(verbosity=2)
-    result = runner.run(suite)
-    
-    # Print summary
-    print("\n" + "=" * 50)
-    print(f"Tests run: {result.testsRun}")
-    print(f"Failures: {len(result.failures)}")
-    print(f"Errors: {len(result.errors)}")
-    
-    if result.failures:
-        print("\n❌ FAILURES:")
-        for test, traceback in result.failures:
-            print(f"  - {test}: {traceback}")
-    
-    if result.errors:
-        print("\n💥 ERRORS:")
-        for test, traceback in result.errors:
-            print(f"  - {test}: {traceback}")
-    
-    if result.wasSuccessful():
-        print("\n✅ All tests passed!")
-        return True
-    else:
-        print("\n❌ Some tests failed!")
-        return False
-
-
-if __name__ == "__main__":
-    success = run_tests()
-    sys.exit(0 if success else 1)
+        # Medians should agree to within a few median absolute deviations
+        self.assertLess(abs(equal_median - different_median), 5 * spread)
@@ -6,7 +6,7 @@ Verifies that all components are properly installed and configured.
 
 import sys
 import os
-import importlib
+import importlib.util
 from pathlib import Path
 
 def check_python_version():
@@ -19,26 +19,27 @@ def check_python_version():
     return True
 
 def check_dependencies():
-    """Check if all required dependencies are installed"""
-    required_packages = [
-        'flask',
-        'flask_sqlalchemy', 
-        'flask_login',
-        'flask_wtf',
-        'bcrypt',
-        'cryptography',
-        'python_dotenv',
-        'email_validator',
-        'wtforms'
-    ]
+    """Check if all required dependencies are installed (without importing them)"""
+    # pip package name -> top-level module it provides
+    required_packages = {
+        'flask': 'flask',
+        'flask-sqlalchemy': 'flask_sqlalchemy',
+        'flask-login': 'flask_login',
+        'flask-wtf': 'flask_wtf',
+        'bcrypt': 'bcrypt',
+        'argon2-cffi': 'argon2',
+        'cryptography': 'cryptography',
+        'python-dotenv': 'dotenv',
+        'email-validator': 'email_validator',
+        'wtforms': 'wtforms'
+    }
     
     missing_packages = []
     
-    for package in required_packages:
-        try:
-            importlib.import_module(package)
+    for package, module in required_packages.items():
+        if importlib.util.find_spec(module) is not None:
             print(f"✅ {package}")
-        except ImportError:
+        else:
             print(f"❌ {package} - MISSING")
             missing_packages.append(package)
     
@@ -63,10 +64,19 @@ def check_project_structure():
         'tests/test_password_manager.py'
     ]
     
+    # One directory listing per parent directory instead of one stat() per file
+    present = set()
+    for directory in {os.path.dirname(file_path) for file_path in required_files}:
+        try:
+            with os.scandir(directory or '.') as entries:
+                present.update(os.path.join(directory, entry.name) for entry in entries)
+        except FileNotFoundError:
+            pass
+    
     missing_files = []
     
     for file_path in required_files:
-        if Path(file_path).exists():
+        if file_path in present:
             print(f"✅ {file_path}")
         else:
             print(f"❌ {file_path} - MISSING")